@@ -0,0 +1,64 @@
+"""pack trainings download options into a bitmask
+
+Revision ID: 7c4a9e1f3b52
+Revises: b3f1c6e2a874
+Create Date: 2026-10-19 18:02:13.417829
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c4a9e1f3b52'
+down_revision: Union[str, None] = 'b3f1c6e2a874'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (column, default) in bit order, must match models.model.DownloadOption
+OPTION_COLUMNS = [
+    ('email', True), ('score', True), ('username', True), ('datetime', True),
+    ('average_compression_depth', False), ('average_hands_off_time', False), ('compression_number', False),
+    ('event_time', False), ('manikin_model', False), ('overall_ccf', False), ('overall_compression_no', False),
+    ('overall_hand_position', False), ('overall_ventilation_rate', False), ('overall_ventilation_volume', False),
+    ('average_compression_rate', False), ('average_volume', False), ('cycle_number', False),
+    ('judge_result', False), ('overall_compression_depth', False), ('overall_compression_rate', False),
+    ('overall_recoil', False), ('overall_ventilation_speed', False), ('percentage_ccf', False),
+    ('target', False), ('type', False), ('device_id', False), ('name', False),
+]
+DEFAULT_OPTIONS = sum(1 << bit for bit, (_, default) in enumerate(OPTION_COLUMNS) if default)
+
+
+def upgrade() -> None:
+    # the table used to be created by create_all only, so it may not exist yet
+    if not sa.inspect(op.get_bind()).has_table('trainings_download_options'):
+        op.create_table('trainings_download_options',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('options', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id')
+        )
+        op.create_index(op.f('ix_trainings_download_options_user_id'), 'trainings_download_options', ['user_id'],
+                        unique=False)
+        return
+
+    op.add_column('trainings_download_options',
+                  sa.Column('options', sa.Integer(), nullable=False, server_default=str(DEFAULT_OPTIONS)))
+    packed = ' + '.join(f'COALESCE(`{column}`, {int(default)}) * {1 << bit}'
+                        for bit, (column, default) in enumerate(OPTION_COLUMNS))
+    op.execute(f'UPDATE trainings_download_options SET options = {packed}')
+    op.alter_column('trainings_download_options', 'options', existing_type=sa.Integer(), existing_nullable=False,
+                    server_default=None)
+    for column, _ in OPTION_COLUMNS:
+        op.drop_column('trainings_download_options', column)
+
+
+def downgrade() -> None:
+    for column, _ in OPTION_COLUMNS:
+        op.add_column('trainings_download_options', sa.Column(column, sa.BOOLEAN(), nullable=True))
+    unpacked = ', '.join(f'`{column}` = (options & {1 << bit}) != 0'
+                         for bit, (column, _) in enumerate(OPTION_COLUMNS))
+    op.execute(f'UPDATE trainings_download_options SET {unpacked}')
+    op.drop_column('trainings_download_options', 'options')
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+from io import BytesIO
+from uuid import uuid4
+
+import requests
+
+from apis.util import get_file_size
+from lru import LRUCache
+
+ANALYSIS_URL = os.getenv('ANALYSIS_URL', 'https://beta.braydenonline.cc/cpr-sequence-analysis')
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', 1024))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv('ANALYSIS_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+TRAINING_UPLOAD_MAX_BYTES = int(os.getenv('TRAINING_UPLOAD_MAX_BYTES', 50 * 1024 * 1024))
+
+CHUNK_SIZE = 64 * 1024
+
+# Usage fields set per request in the condition and echoed back in the result
+USAGE_REQUEST_FIELDS = ('Email', 'Timestamp', 'CreateEpoch')
+
+# raw analysis responses, bounded by entry count and total bytes
+analysis_cache = LRUCache(ANALYSIS_CACHE_MAX_ENTRIES, ANALYSIS_CACHE_MAX_BYTES, sizeof=len)
+
+
+# multipart/form-data body read in chunks by requests, files are streamed from their (spooled) file objects
+class MultipartStream:
+    def __init__(self, fields: list):
+        self.boundary = uuid4().hex
+        self.len = 0
+        self._parts = []
+        self._index = 0
+        for name, (filename, value, content_type) in fields:
+            self._append(BytesIO((f'--{self.boundary}\r\n'
+                                  f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                                  f'Content-Type: {content_type}\r\n\r\n').encode('utf-8')))
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            if isinstance(value, bytes):
+                self._append(BytesIO(value))
+            else:
+                self._append(value)
+            self._append(BytesIO(b'\r\n'))
+        self._append(BytesIO(f'--{self.boundary}--\r\n'.encode('utf-8')))
+
+    def _append(self, part):
+        part.seek(0)
+        self.len += get_file_size(part)
+        self._parts.append(part)
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def read(self, size: int = -1):
+        chunks = []
+        remaining = size
+        while self._index < len(self._parts) and remaining != 0:
+            chunk = self._parts[self._index].read(remaining)
+            if not chunk:
+                self._index += 1
+                continue
+            chunks.append(chunk)
+            if remaining > 0:
+                remaining -= len(chunk)
+        return b''.join(chunks)
+
+
+def normalize_condition(condition: dict):
+    # only the fields that change the analysis result are part of the cache key
+    train_course = condition['Custom']['TrainCourse']
+    return {
+        'guideline': train_course['Guideline'],
+        'type': train_course['Type'],
+        'feedback': train_course['Feedback'],
+        'certification': train_course['Certification']
+    }
+
+
+def hash_analysis_request(condition: dict, raw_file, user_id: int):
+    digest = hashlib.sha256()
+    raw_file.seek(0)
+    for chunk in iter(lambda: raw_file.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    raw_file.seek(0)
+    digest.update(json.dumps(normalize_condition(condition), sort_keys=True).encode('utf-8'))
+    # results echo the submitter, they are never shared between users
+    digest.update(str(user_id).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def restamp_usage(result: dict, condition: dict):
+    # a cached result carries the Usage of the first submission, replace it with this request's values
+    usage = result.get('Usage')
+    if usage is not None:
+        for field in USAGE_REQUEST_FIELDS:
+            if field in usage and field in condition['Usage']:
+                usage[field] = condition['Usage'][field]
+    return result
+
+
+def request_sequence_analysis(condition: dict, raw_file, user_id: int):
+    key = hash_analysis_request(condition, raw_file, user_id)
+    content = analysis_cache.get(key)
+    if content is not None:
+        return restamp_usage(json.loads(content), condition)
+
+    body = MultipartStream([
+        ('data', ('genk-adult-pass_train_condition.json', json.dumps(condition), 'application/json')),
+        ('rawHexBPfile', ('genk-adult-pass_rawHexBPfile.bin', raw_file, 'application/octet-stream'))])
+    response = requests.post(ANALYSIS_URL, headers={'Content-Type': body.content_type}, data=body)
+    content = response.content
+    if response.ok:
+        analysis_cache.put(key, content)
+    return json.loads(content)
@@ -1,7 +1,7 @@
 from fastapi import APIRouter
 
 from . import users, authorization, training_programs, content, certifications_template, trainings, accounts, \
-    certification
+    certification, files
 
 api_router = APIRouter()
 
@@ -13,3 +13,4 @@ api_router.include_router(certifications_template.router, tags=["certification_t
 api_router.include_router(trainings.router, tags=["trainings"])
 api_router.include_router(accounts.router, tags=["accounts"])
 api_router.include_router(certification.router, tags=["certification"])
+api_router.include_router(files.router, tags=["files"])
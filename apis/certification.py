@@ -1,30 +1,46 @@
 import logging
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
-from enum import Enum
+from functools import partial
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
 
-from sqlalchemy.orm import Session
-from sqlalchemy.sql import select, and_
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.sql import select, and_, exists
 
-from database import get_db
+from apis.util import get_token_by_header, get_user_by_token, check_authorized_by_user, get_latest_certifications
+from database import get_db, SessionLocal
 from exceptions import GetExceptionWithStatuscode, ExceptionType
 
-from boto3 import client
-from pyhtml2pdf import converter
+from certificates import certificate_pdf_key, certificate_etag, get_certificate_pdf, iterate_zip, RendererPoolBusy, \
+    CERTIFICATE_RENDERER_POOL_SIZE
 
 from models.model import CertificationsTemplate, User, Certification, Training, TrainingProgram
+from schema.certification import BulkDownloadRequestSchema, ExpiringCertificateSchema, ExpiringCertificateListSchema
 
 router = APIRouter(prefix='/certifications')
-BUCKET_NAME = 'brayden-online-v2-api-storage'
 
+# expires_at of a certificate issued now, older rows were backfilled with the same period
+CERTIFICATE_VALIDITY = timedelta(days=365)
 
-def save_certification(issued_certification):
-    # save update format
-    with open('certificate_download_format_update.html', 'w') as f:
-        f.write(issued_certification)
+# background renders use at most this many renderers, the rest of the pool stays free for downloads
+CERTIFICATE_PRERENDER_WORKERS = int(os.getenv('CERTIFICATE_PRERENDER_WORKERS', 1))
+
+# renders of bulk downloads, shared by all bulk requests
+CERTIFICATE_BULK_WORKERS = int(os.getenv('CERTIFICATE_BULK_WORKERS', CERTIFICATE_RENDERER_POOL_SIZE))
+# certificates rendered or waiting to be written per bulk download, bounds its memory
+CERTIFICATE_BULK_MAX_PENDING = int(os.getenv('CERTIFICATE_BULK_MAX_PENDING', 2 * CERTIFICATE_BULK_WORKERS))
+
+# characters kept in file names inside the bulk archive
+FILE_NAME_PATTERN = re.compile(r'[^\w.-]+')
+
+certificate_executor = ThreadPoolExecutor(max_workers=CERTIFICATE_PRERENDER_WORKERS,
+                                          thread_name_prefix='certificate-prerender')
+certificate_bulk_executor = ThreadPoolExecutor(max_workers=CERTIFICATE_BULK_WORKERS,
+                                               thread_name_prefix='certificate-bulk')
 
 
 def get_certification_template_by_manikin_type(manikin_type, organization_id, db):
@@ -40,84 +56,34 @@ def get_certification_template_by_manikin_type(manikin_type, organization_id, db
     return template
 
 
-def read_certificate_download_format():
-    with open('certificate_download_format.html', 'r') as f:
-        issued_certificate_format = f.read()
-    return issued_certificate_format
-
-
-def convert_html_to_pdf():
-    html_path = os.path.abspath('certificate_download_format_update.html')
-    file_name = 'issued_certificate.pdf'
-    converter.convert(f'file:///{html_path}', file_name, print_options={"landscape": True})
-    return file_name
+def get_issued_certificate_pdf(key: str, template: CertificationsTemplate, user_name: str):
+    return get_certificate_pdf(key, template, user_name, '2023-12-20')
 
 
-def authorize_aws_s3():
-    if os.environ.get('aws_access_key_id') and os.environ.get('aws_secret_access_key'):
-        access_key = os.environ.get('aws_access_key_id')
-        secret_access_key = os.environ.get('aws_secret_access_key')
-        s3 = client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_access_key)
-    else:
-        s3 = client('s3')
-    return s3
+def prerender_certificate(certification_id: int):
+    # runs on certificate_executor after the certification is committed, so the first download finds the pdf
+    db = SessionLocal()
+    try:
+        query = (select(Certification, User, TrainingProgram.manikin_type)
+                 .join(User, User.id == Certification.user_id)
+                 .join(Training, Training.id == Certification.training_id)
+                 .join(TrainingProgram, TrainingProgram.id == Training.training_program_id)
+                 .where(Certification.id == certification_id))
+        certification, user, manikin_type = db.execute(query).one()
+        template = get_certification_template_by_manikin_type(manikin_type, user.organization_id, db)
+        get_issued_certificate_pdf(certificate_pdf_key(certification.id, template, user.name), template, user.name)
+    except Exception as e:
+        logging.error(f'could not pre-render certificate {certification_id}: {e}')
+    finally:
+        db.close()
 
 
-def get_presigned_url_from_upload_file(filename):
-    if not filename:
-        return
-    s3 = authorize_aws_s3()
-    return s3.generate_presigned_url('get_object', Params={'Bucket': BUCKET_NAME, 'Key': filename}, ExpiresIn=3600)
-
-
-def replace_certificate_format_from_data(issued_certificate_format, template, user):
-    class DefaultTemplateIdentifier(Enum):
-        user_name = 'user_name'
-        certification = 'certification_title'
-        manikin_type = 'manikin_type'
-        organization_name = 'organization_name'
-        formatted_date = 'formatted_date'
-
-    # assign certificate format to certification template, user data
-    result = issued_certificate_format
-
-    # TODO 리팩토링 해야함!
-    for idx, str in enumerate([user.name,
-                               template.title if template.title else "",
-                               template.manikin_type,
-                               template.organization_name,
-                               '2023-12-20']):
-        result = result.replace([e.value for e in DefaultTemplateIdentifier][idx], str)
-    # get image url from s3
-    if template.images['top_left']:
-        result = (result.replace
-                  ('top_left',
-                   f"\"{get_presigned_url_from_upload_file(template.images['top_left'])}\""))
-    else:
-        result = result.replace('<img class="logo" src=top_left alt="로고">', "")
-    if template.images['top_right']:
-        result = (result.replace
-                  ('top_right',
-                   f"\"{get_presigned_url_from_upload_file(template.images['top_right'])}\""))
-    else:
-        result = result.replace('<img class="logo" src=top_right alt="로고">', "")
-    if template.images['bottom_left']:
-        result = (result.replace
-                  ('bottom_left',
-                   f"\"{get_presigned_url_from_upload_file(template.images['bottom_left'])}\""))
-    else:
-        result = result.replace('<img class="logo" src=bottom_left alt="로고">', "")
-    if template.images['bottom_right']:
-        result = (result.replace
-                  ('bottom_right',
-                   f"\"{get_presigned_url_from_upload_file(template.images['bottom_right'])}\""))
-    else:
-        result = result.replace('<img class="logo" src=bottom_right alt="로고">', "")
-    return result
+def enqueue_certificate_render(certification_id: int):
+    certificate_executor.submit(prerender_certificate, certification_id)
 
 
 def check_expired_certificates(certification: Certification):
-    if certification.issued_date + timedelta(days=365) <= datetime.now():
+    if certification.expires_at <= datetime.now():
         raise GetExceptionWithStatuscode(status_code=status.HTTP_404_NOT_FOUND,
                                          message="Certification expired",
                                          exception_type=ExceptionType.NOT_MATCHED)
@@ -126,26 +92,22 @@ def check_expired_certificates(certification: Certification):
 
 def get_user_by_id(user_id: int, manikin_type: str, db: Session = Depends(get_db)):
     # 다운받기 전 발급받은 인증서가 있는지 확인
-    users = (db.query(User, Certification, Training, TrainingProgram)
-             .outerjoin(Training, User.id == Training.user_id)
-             .outerjoin(TrainingProgram, TrainingProgram.id == Training.training_program_id)
-             .outerjoin(Certification, Certification.training_id == Training.id)
-             .filter(and_(User.id == user_id, TrainingProgram.manikin_type == manikin_type))
-             .order_by(Training.date.desc()))
-    user, certification, training, training_program = users[0]
-    if not user:
+    user, _, certifications = get_latest_certifications(user_id, db, manikin_type)
+    certification = certifications.get(manikin_type)
+    if not certification:
         raise GetExceptionWithStatuscode(status_code=status.HTTP_404_NOT_FOUND,
-                                         message="there is no user",
+                                         message="there is no certification",
                                          exception_type=ExceptionType.NOT_FOUND)
     # 다운받기 전 인증서 기한이 만료됐는지 확인
     check_expired_certificates(certification)
-    return user
+    return user, certification
 
 
 @router.get('/download/{user_id}')
-def get_issued_certificate(user_id: int, manikin_type: str = 'adult', db: Session = Depends(get_db)):
+def get_issued_certificate(user_id: int, request: Request, manikin_type: str = 'adult',
+                           db: Session = Depends(get_db)):
     try:
-        user = get_user_by_id(user_id, manikin_type, db)
+        user, certification = get_user_by_id(user_id, manikin_type, db)
         template = get_certification_template_by_manikin_type(manikin_type, user.organization_id, db)
     except GetExceptionWithStatuscode as e:
         if e.exception_type == ExceptionType.NOT_FOUND:
@@ -156,12 +118,118 @@ def get_issued_certificate(user_id: int, manikin_type: str = 'adult', db: Sessio
         print(e)
         return
 
-    issued_certificate_format = replace_certificate_format_from_data(read_certificate_download_format(),
-                                                                     template,
-                                                                     user)
+    # rendered once per certificate, template version and user name, repeat downloads are served from storage
+    key = certificate_pdf_key(certification.id, template, user.name)
+    headers = {'ETag': certificate_etag(key), 'Cache-Control': 'private, no-cache'}
+    if headers['ETag'] in request.headers.get('if-none-match', ''):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-    save_certification(issued_certificate_format)
-
-    file_name = convert_html_to_pdf()
-
-    return FileResponse(file_name)
+    try:
+        pdf = get_issued_certificate_pdf(key, template, user.name)
+    except RendererPoolBusy as e:
+        logging.error(e)
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+    headers['Content-Disposition'] = 'inline; filename="issued_certificate.pdf"'
+    return Response(pdf, media_type='application/pdf', headers=headers)
+
+
+def iterate_bulk_certificates(organization_id: int, template: CertificationsTemplate,
+                              data: BulkDownloadRequestSchema):
+    # the latest valid certificate of each user, read in batches with its own session because the
+    # response is streamed after the request's session is closed
+    query = (select(Certification.id, User.id, User.name)
+             .join(User, User.id == Certification.user_id)
+             .join(Training, Training.id == Certification.training_id)
+             .join(TrainingProgram, TrainingProgram.id == Training.training_program_id)
+             .where(and_(User.organization_id == organization_id,
+                         TrainingProgram.manikin_type == data.manikin_type,
+                         Certification.expires_at > datetime.now()))
+             .order_by(User.id, Certification.issued_date.desc()))
+    if data.user_ids:
+        query = query.where(User.id.in_(data.user_ids))
+    if data.start_date:
+        query = query.where(Certification.issued_date >= datetime.strptime(data.start_date, "%Y-%m-%d"))
+    if data.end_date:
+        end_date = datetime.strptime(data.end_date, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
+        query = query.where(Certification.issued_date <= end_date)
+
+    db = SessionLocal()
+    try:
+        last_user_id = None
+        for certification_id, user_id, user_name in db.execute(query.execution_options(yield_per=500)):
+            if user_id == last_user_id:
+                continue
+            last_user_id = user_id
+            key = certificate_pdf_key(certification_id, template, user_name)
+            file_name = f"{user_id}_{FILE_NAME_PATTERN.sub('_', user_name or '')}.pdf"
+            yield file_name, partial(get_issued_certificate_pdf, key, template, user_name)
+    finally:
+        db.close()
+
+
+@router.post('/download')
+def download_issued_certificates(data: BulkDownloadRequestSchema, request: Request, db: Session = Depends(get_db)):
+    try:
+        token = get_token_by_header(request)
+        user = get_user_by_token(token, db)
+        check_authorized_by_user(user)
+        template = get_certification_template_by_manikin_type(data.manikin_type, user.organization_id, db)
+    except GetExceptionWithStatuscode as e:
+        logging.error(e)
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+    # certificates are rendered in parallel and written to the archive as they finish
+    certificates = iterate_bulk_certificates(user.organization_id, template, data)
+    return StreamingResponse(iterate_zip(certificates, certificate_bulk_executor, CERTIFICATE_BULK_MAX_PENDING),
+                             media_type='application/zip',
+                             headers={'Content-Disposition': 'attachment; filename="certificates.zip"'})
+
+
+def get_expiring_certificates(organization_id: int, manikin_type: str, expires_from: datetime,
+                              expires_to: datetime, db: Session = Depends(get_db)):
+    # range scan of ix_certification_expires_at, certificates already renewed by a later one are skipped
+    renewed = aliased(Certification)
+    renewed_training = aliased(Training)
+    renewed_program = aliased(TrainingProgram)
+    renewal = (select(renewed.id)
+               .join(renewed_training, renewed_training.id == renewed.training_id)
+               .join(renewed_program, renewed_program.id == renewed_training.training_program_id)
+               .where(and_(renewed.user_id == Certification.user_id,
+                           renewed_program.manikin_type == manikin_type,
+                           renewed.expires_at > Certification.expires_at)))
+    query = (select(Certification, User)
+             .join(User, User.id == Certification.user_id)
+             .join(Training, Training.id == Certification.training_id)
+             .join(TrainingProgram, TrainingProgram.id == Training.training_program_id)
+             .where(and_(Certification.expires_at >= expires_from,
+                         Certification.expires_at < expires_to,
+                         User.organization_id == organization_id,
+                         TrainingProgram.manikin_type == manikin_type,
+                         ~exists(renewal)))
+             .order_by(Certification.expires_at))
+    return db.execute(query).all()
+
+
+@router.get('/expiring', response_model=ExpiringCertificateListSchema)
+def get_expiring_certificate_list(request: Request, manikin_type: str = 'adult', days: int = 30,
+                                  expired_days: int = 30, db: Session = Depends(get_db)):
+    # certificates expiring in the next `days` days and the ones that expired in the last `expired_days` days
+    try:
+        token = get_token_by_header(request)
+        user = get_user_by_token(token, db)
+        check_authorized_by_user(user)
+    except GetExceptionWithStatuscode as e:
+        logging.error(e)
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+    now = datetime.now()
+    results = get_expiring_certificates(user.organization_id, manikin_type, now - timedelta(days=expired_days),
+                                        now + timedelta(days=days), db)
+    certifications = [ExpiringCertificateSchema(certification_id=certification.id, user_id=u.id, name=u.name,
+                                                email=u.email, employee_id=u.employee_id,
+                                                issued_date=certification.issued_date,
+                                                expires_at=certification.expires_at,
+                                                expired=certification.expires_at <= now)
+                      for certification, u in results]
+    return ExpiringCertificateListSchema(manikin_type=manikin_type, certifications=certifications)
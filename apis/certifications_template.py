@@ -1,44 +1,31 @@
 import logging
 import os
 from datetime import datetime
-from enum import Enum
 
 from fastapi import APIRouter, status, HTTPException, Request, Depends, UploadFile
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
 
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy.sql import select, and_, update
 
 from apis.util import get_user_by_token, get_token_by_header
 from database import get_db
+from storage import file_storage
 from exceptions import GetExceptionWithStatuscode, ExceptionType
 from models.model import CertificationsTemplate, User
 
 from schema.certifications_template import GetResponseSchema, UpdateRequestSchema
-from boto3 import client
 
-from pyhtml2pdf import converter
+from certificates import render_pdf, render_certificate_html, normalize_logo, InvalidLogo, RendererPoolBusy
 
 router = APIRouter(prefix='/certifications_template')
 
-BUCKET_NAME = 'brayden-online-v2-api-storage'
-
-
-def authorize_aws_s3():
-    if os.environ.get('aws_access_key_id') and os.environ.get('aws_secret_access_key'):
-        access_key = os.environ.get('aws_access_key_id')
-        secret_access_key = os.environ.get('aws_secret_access_key')
-        s3 = client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_access_key)
-    else:
-        s3 = client('s3')
-    return s3
-
 
 def get_presigned_url_from_upload_file(filename):
     if not filename:
         return
-    s3 = authorize_aws_s3()
-    return s3.generate_presigned_url('get_object', Params={'Bucket': BUCKET_NAME, 'Key': filename}, ExpiresIn=3600)
+    return file_storage.url(filename)
 
 
 def get_milliseconds():
@@ -48,19 +35,19 @@ def get_milliseconds():
 
 
 def upload_file_to_s3(file: UploadFile):
-    s3 = authorize_aws_s3()
-    buckets = [i['Name'] for i in s3.list_buckets()['Buckets']]
-    if BUCKET_NAME in buckets:
-        ret = s3.put_object(Bucket=BUCKET_NAME, Key=file.filename, Body=file.file)
-        location = s3.get_bucket_location(Bucket=BUCKET_NAME)['LocationConstraint']
-        return location
-    return False
+    # logos are stored as png at the size they are printed at, certificates inline them from memory
+    try:
+        logo = normalize_logo(file.file)
+    except InvalidLogo as e:
+        logging.error(e)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='incorrect file format')
+    return file_storage.put(file.filename, logo)
 
 
 def upload_file_and_get_presigned_url(upload_file):
     url = None
-    base_name, extension = os.path.splitext(upload_file.filename)
-    upload_file.filename = f"{base_name}_{get_milliseconds()}{extension}"
+    base_name = os.path.splitext(upload_file.filename)[0]
+    upload_file.filename = f"{base_name}_{get_milliseconds()}.png"
     if upload_file_to_s3(upload_file):
         url = get_presigned_url_from_upload_file(upload_file.filename)
     return url, upload_file.filename
@@ -108,7 +95,7 @@ async def update_certification_template(
         raise HTTPException(status_code=e.status_code, detail=e.message)
 
     if data.top_left and data.top_left.filename:
-        image_url, update_filename = upload_file_and_get_presigned_url(data.top_left)
+        image_url, update_filename = await run_in_threadpool(upload_file_and_get_presigned_url, data.top_left)
         file_names['top_left'] = update_filename
         images_url['top_left'] = image_url
     elif data.top_left and not data.top_left.filename:
@@ -116,7 +103,7 @@ async def update_certification_template(
         images_url['top_left'] = None
 
     if data.top_right and data.top_right.filename:
-        image_url, update_filename = upload_file_and_get_presigned_url(data.top_right)
+        image_url, update_filename = await run_in_threadpool(upload_file_and_get_presigned_url, data.top_right)
         file_names['top_right'] = update_filename
         images_url['top_right'] = image_url
     elif data.top_right and not data.top_right.filename:
@@ -124,7 +111,7 @@ async def update_certification_template(
         images_url['top_right'] = None
 
     if data.bottom_left and data.bottom_left.filename:
-        image_url, update_filename = upload_file_and_get_presigned_url(data.bottom_left)
+        image_url, update_filename = await run_in_threadpool(upload_file_and_get_presigned_url, data.bottom_left)
         file_names['bottom_left'] = update_filename
         images_url['bottom_left'] = image_url
     elif data.bottom_left and not data.bottom_left.filename:
@@ -132,7 +119,7 @@ async def update_certification_template(
         images_url['bottom_left'] = None
 
     if data.bottom_right and data.bottom_right.filename:
-        image_url, update_filename = upload_file_and_get_presigned_url(data.bottom_right)
+        image_url, update_filename = await run_in_threadpool(upload_file_and_get_presigned_url, data.bottom_right)
         file_names['bottom_right'] = update_filename
         images_url['bottom_right'] = image_url
     elif data.bottom_right and not data.bottom_right.filename:
@@ -147,6 +134,7 @@ async def update_certification_template(
             update_value[k] = v
     if title:
         update_value['title'] = title
+    update_value['version'] = CertificationsTemplate.version + 1
     query = (update(CertificationsTemplate).where(CertificationsTemplate.id == certification.id).values(update_value))
     db.execute(query)
     db.commit()
@@ -160,52 +148,6 @@ async def update_certification_template(
     return certification.convert_to_schema
 
 
-def replace_certificate_format_from_data(issued_certificate_format, template, user):
-    class DefaultTemplateIdentifier(Enum):
-        user_name = 'user_name'
-        certification = 'certification_title'
-        manikin_type = 'manikin_type'
-        organization_name = 'organization_name'
-        formatted_date = 'formatted_date'
-
-    # assign certificate format to certification template, user data
-    result = issued_certificate_format
-
-    # TODO 리팩토링 해야함!
-    for idx, str in enumerate([user.name,
-                               template.title if template.title else "",
-                               template.manikin_type,
-                               template.organization_name,
-                               '2023-12-20']):
-        result = result.replace([e.value for e in DefaultTemplateIdentifier][idx], str)
-    # get image url from s3
-    if template.images['top_left']:
-        result = (result.replace
-                  ('top_left',
-                   f"\"{get_presigned_url_from_upload_file(template.images['top_left'])}\""))
-    else:
-        result = result.replace('<img class="logo" src=top_left alt="로고">', "")
-    if template.images['top_right']:
-        result = (result.replace
-                  ('top_right',
-                   f"\"{get_presigned_url_from_upload_file(template.images['top_right'])}\""))
-    else:
-        result = result.replace('<img class="logo" src=top_right alt="로고">', "")
-    if template.images['bottom_left']:
-        result = (result.replace
-                  ('bottom_left',
-                   f"\"{get_presigned_url_from_upload_file(template.images['bottom_left'])}\""))
-    else:
-        result = result.replace('<img class="logo" src=bottom_left alt="로고">', "")
-    if template.images['bottom_right']:
-        result = (result.replace
-                  ('bottom_right',
-                   f"\"{get_presigned_url_from_upload_file(template.images['bottom_right'])}\""))
-    else:
-        result = result.replace('<img class="logo" src=bottom_right alt="로고">', "")
-    return result
-
-
 def get_user_by_id(user_id: int, db: Session = Depends(get_db)):
     user = db.query(User).get(user_id)
     if not user:
@@ -226,23 +168,10 @@ def get_certification_template_by_manikin_type(db, manikin_type):
     return template
 
 
-def save_certification(issued_certification):
-    # save update format
-    with open('certificate_download_format_update.html', 'w') as f:
-        f.write(issued_certification)
-
-
-def read_certificate_download_format():
-    with open('certificate_download_format.html', 'r') as f:
-        issued_certificate_format = f.read()
-    return issued_certificate_format
-
-
-def convert_html_to_pdf():
-    html_path = os.path.abspath('certificate_download_format_update.html')
-    file_name = 'issued_certificate.pdf'
-    converter.convert(f'file:///{html_path}', file_name, print_options={"landscape": True})
-    return file_name
+def convert_html_to_pdf(issued_certificate: str):
+    # borrows a warm Chrome session from the pool instead of starting one per download, the html and the
+    # pdf stay in memory so concurrent downloads do not share any file
+    return render_pdf(issued_certificate)
 
 
 # TODO 발급 받은 인증서는 따로 빼야할거 같음
@@ -257,12 +186,13 @@ def get_issued_certificate(user_id: int, manikin_type: str = 'adult', db: Sessio
             raise HTTPException(e.status_code, e.message)
         return
 
-    issued_certificate_format = replace_certificate_format_from_data(read_certificate_download_format(),
-                                                                     template,
-                                                                     user)
+    issued_certificate_format = render_certificate_html(template, user.name, '2023-12-20')
 
-    save_certification(issued_certificate_format)
-
-    file_name = convert_html_to_pdf()
+    try:
+        pdf = convert_html_to_pdf(issued_certificate_format)
+    except RendererPoolBusy as e:
+        logging.error(e)
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
 
-    return FileResponse(file_name)
+    return Response(pdf, media_type='application/pdf',
+                    headers={'Content-Disposition': 'inline; filename="issued_certificate.pdf"'})
@@ -1,16 +1,18 @@
 import logging
 import os
+import time
 from fastapi import APIRouter, status, Depends, UploadFile, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import select, and_
 
 from datetime import datetime
 
-from apis.util import get_token_by_header, get_user_by_token, check_authorized_by_user
+from apis.storage_outbox import enqueue_storage_delete, storage_delete_sweeper
+from apis.util import get_token_by_header, get_user_by_token, check_authorized_by_user, get_file_size
 from database import get_db
-
-from boto3 import client
+from storage import file_storage
 
 from exceptions import GetExceptionWithStatuscode, ExceptionType
 from models.model import TrainingProgramContent, OrganizationContent
@@ -18,18 +20,7 @@ from schema.content import ContentCreateResponseSchema
 
 router = APIRouter(prefix='/contents')
 
-BUCKET_NAME = 'brayden-online-v2-api-storage'
-
-
-def authorize_aws_s3():
-    if os.environ.get('aws_access_key_id') and os.environ.get('aws_secret_access_key'):
-        access_key = os.environ.get('aws_access_key_id')
-        secret_access_key = os.environ.get('aws_secret_access_key')
-        s3 = client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_access_key)
-    else:
-        s3 = client('s3')
-    return s3
-
+logger = logging.getLogger(__name__)
 
 # TODO common file로 따로 빼놓기
 def get_milliseconds():
@@ -39,19 +30,17 @@ def get_milliseconds():
 
 
 def upload_file_to_s3(file: UploadFile):
-    s3 = authorize_aws_s3()
-    buckets = [i['Name'] for i in s3.list_buckets()['Buckets']]
-    if BUCKET_NAME in buckets:
-        base_name, extension = os.path.splitext(file.filename)
-        dir = 'content/'
-        key = f"{dir}{base_name}_{get_milliseconds()}{extension}"
+    base_name, extension = os.path.splitext(file.filename)
+    dir = 'content/'
+    key = f"{dir}{base_name}_{get_milliseconds()}{extension}"
 
-        ret = s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=file.file)
-        if ret:
-            return key
-        else:
-            return False
-    return False
+    started = time.perf_counter()
+    if not file_storage.put(key, file.file):
+        return False
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    size = get_file_size(file.file)
+    logger.info(f'uploaded {key}: {size} bytes in {elapsed:.3f}s ({size / elapsed / 1024 / 1024:.2f} MiB/s)')
+    return key
 
 
 @router.post('/training/{training_program_id}', status_code=status.HTTP_201_CREATED,
@@ -67,7 +56,7 @@ async def create_training_content(request: Request, content: UploadFile, trainin
         raise HTTPException(status_code=e.status_code, detail=e.message)
 
     # upload file to s3
-    s3_key = upload_file_to_s3(content)
+    s3_key = await run_in_threadpool(upload_file_to_s3, content)
     if not s3_key:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='could not upload file')
 
@@ -113,11 +102,10 @@ async def delete_training_content(request: Request, content_id: int, db: Session
 
         training_content = check_exist_training_content(content_id, db)
         db.delete(training_content)
-
-        # s3 delete
-        s3 = authorize_aws_s3()
-        ret = s3.delete_object(Bucket=BUCKET_NAME, Key=training_content.s3_key)
+        # the object is deleted from the storage after the commit
+        enqueue_storage_delete(training_content.s3_key, db)
         db.commit()
+        storage_delete_sweeper.wake()
         return
     except GetExceptionWithStatuscode as e:
         logging.error(e)
@@ -138,7 +126,7 @@ async def create_manikin_connected(request: Request, manikin_type: str, content:
         raise HTTPException(status_code=e.status_code, detail=e.message)
 
     # upload file to s3
-    s3_key = upload_file_to_s3(content)
+    s3_key = await run_in_threadpool(upload_file_to_s3, content)
     if not s3_key:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='could not upload file')
 
@@ -191,11 +179,10 @@ async def delete_manikin_connected(request: Request, content_id: int, db: Sessio
         check_authorized_by_user(user)
         organization_content = check_exist_organization_content(content_id, db)
         db.delete(organization_content)
-
-        # s3 delete
-        s3 = authorize_aws_s3()
-        ret = s3.delete_object(Bucket=BUCKET_NAME, Key=organization_content.s3_key)
+        # the object is deleted from the storage after the commit
+        enqueue_storage_delete(organization_content.s3_key, db)
         db.commit()
+        storage_delete_sweeper.wake()
         return
     except GetExceptionWithStatuscode as e:
         logging.error(e)
@@ -213,7 +200,7 @@ async def create_login_content(request: Request, content: UploadFile, db: Sessio
         logging.error(e)
         raise HTTPException(status_code=e.status_code, detail=e.message)
     # upload file to s3
-    s3_key = upload_file_to_s3(content)
+    s3_key = await run_in_threadpool(upload_file_to_s3, content)
     if not s3_key:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='could not upload file')
 
@@ -250,11 +237,10 @@ async def delete_login_content(request: Request, content_id: int, db: Session =
 
         organization_content = check_exist_organization_content(content_id, db)
         db.delete(organization_content)
-
-        # s3 delete
-        s3 = authorize_aws_s3()
-        ret = s3.delete_object(Bucket=BUCKET_NAME, Key=organization_content.s3_key)
+        # the object is deleted from the storage after the commit
+        enqueue_storage_delete(organization_content.s3_key, db)
         db.commit()
+        storage_delete_sweeper.wake()
         return
     except GetExceptionWithStatuscode as e:
         logging.error(e)
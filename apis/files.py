@@ -0,0 +1,80 @@
+import mimetypes
+import os
+import re
+import time
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
+
+from storage import file_storage, LocalStorage
+
+router = APIRouter(prefix='/files')
+
+CHUNK_SIZE = 256 * 1024
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def parse_range(range_header: str, size: int):
+    # single ranges only, which is what video players and download managers send
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # suffix range, the last n bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise HTTPException(status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            headers={'Content-Range': f'bytes */{size}'})
+    return start, end
+
+
+def iterate_file(path: str, start: int, length: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@router.get('/{key:path}')
+def get_file(key: str, expires: int, signature: str, request: Request):
+    if not isinstance(file_storage, LocalStorage):
+        raise HTTPException(status.HTTP_404_NOT_FOUND)
+    if not file_storage.verify(key, expires, signature):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, detail="invalid or expired signature")
+    try:
+        path = file_storage.path(key)
+        stat = os.stat(path)
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status.HTTP_404_NOT_FOUND)
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        # the url expires, the content behind a key only changes with the etag
+        'Cache-Control': f'private, max-age={max(expires - int(time.time()), 0)}'
+    }
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    media_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    byte_range = None
+    # a stale If-Range means the client has another version, send the whole file
+    if 'range' in request.headers and request.headers.get('if-range', etag) == etag:
+        byte_range = parse_range(request.headers['range'], stat.st_size)
+    if byte_range is None:
+        headers['Content-Length'] = str(stat.st_size)
+        return StreamingResponse(iterate_file(path, 0, stat.st_size), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(iterate_file(path, start, end - start + 1), status_code=status.HTTP_206_PARTIAL_CONTENT,
+                             media_type=media_type, headers=headers)
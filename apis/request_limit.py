@@ -0,0 +1,45 @@
+import os
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+from apis.analysis import TRAINING_UPLOAD_MAX_BYTES
+
+# whole multipart body of a training submission, the recording plus the form fields and boundaries
+TRAINING_REQUEST_MAX_BYTES = int(os.getenv('TRAINING_REQUEST_MAX_BYTES', TRAINING_UPLOAD_MAX_BYTES + 1024 * 1024))
+
+REQUEST_TOO_LARGE = 'request body is too large'
+
+
+# rejects uploads to the given paths over max_bytes before their body is spooled
+class RequestSizeLimitMiddleware:
+    def __init__(self, app, max_bytes: int, paths: set):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get('content-length')
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse({'detail': REQUEST_TOO_LARGE}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    # raised inside the form parser, FastAPI turns it into the response
+                    raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=REQUEST_TOO_LARGE)
+            return message
+
+        await self.app(scope, receive_limited, send)
@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import select, or_
+
+from database import SessionLocal
+from models.model import StorageDeleteOutbox
+from storage import file_storage, Storage
+
+STORAGE_DELETE_SWEEP_INTERVAL = float(os.getenv('STORAGE_DELETE_SWEEP_INTERVAL', 30))
+STORAGE_DELETE_BATCH_SIZE = int(os.getenv('STORAGE_DELETE_BATCH_SIZE', 500))
+STORAGE_DELETE_MAX_ATTEMPTS = int(os.getenv('STORAGE_DELETE_MAX_ATTEMPTS', 8))
+# seconds before the first retry, doubled for every further attempt
+STORAGE_DELETE_RETRY_DELAY = float(os.getenv('STORAGE_DELETE_RETRY_DELAY', 30))
+
+
+def enqueue_storage_delete(key: str, db: Session):
+    # committed together with the caller's transaction, the sweeper deletes the object afterwards
+    if key:
+        db.add(StorageDeleteOutbox(object_key=key))
+
+
+# deletes the objects recorded in storage_delete_outbox in batches, failed keys are retried with backoff
+class StorageDeleteSweeper:
+    def __init__(self, session_factory, storage: Storage, batch_size: int, interval: float, max_attempts: int,
+                 retry_delay: float):
+        self.session_factory = session_factory
+        self.storage = storage
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='storage-delete-sweeper', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while self.sweep() == self.batch_size:
+                    pass
+            except Exception as e:
+                logging.error(e)
+
+    def sweep(self):
+        now = datetime.now()
+        db = self.session_factory()
+        try:
+            query = (select(StorageDeleteOutbox)
+                     .where(StorageDeleteOutbox.attempts < self.max_attempts,
+                            or_(StorageDeleteOutbox.next_attempt_at.is_(None),
+                                StorageDeleteOutbox.next_attempt_at <= now))
+                     .order_by(StorageDeleteOutbox.id)
+                     .limit(self.batch_size)
+                     # other workers skip the rows this one is deleting
+                     .with_for_update(skip_locked=True))
+            rows = db.scalars(query).all()
+            if not rows:
+                db.rollback()
+                return 0
+
+            failed = self.storage.delete_many(list({row.object_key for row in rows}))
+            for row in rows:
+                if row.object_key not in failed:
+                    db.delete(row)
+                    continue
+                row.attempts += 1
+                row.next_attempt_at = now + timedelta(seconds=self.retry_delay * 2 ** (row.attempts - 1))
+                row.last_error = failed[row.object_key][:300]
+                logging.error(f'could not delete {row.object_key} (attempt {row.attempts}): {row.last_error}')
+            db.commit()
+            return len(rows)
+        finally:
+            db.close()
+
+
+storage_delete_sweeper = StorageDeleteSweeper(SessionLocal, file_storage, STORAGE_DELETE_BATCH_SIZE,
+                                              STORAGE_DELETE_SWEEP_INTERVAL, STORAGE_DELETE_MAX_ATTEMPTS,
+                                              STORAGE_DELETE_RETRY_DELAY)
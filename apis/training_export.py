@@ -0,0 +1,369 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from io import StringIO
+from itertools import chain, islice
+from tempfile import NamedTemporaryFile
+from typing import NamedTuple, Any, Iterable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import select, func
+
+from database import SessionLocal
+from storage import file_storage
+from models.model import Training, User, TrainingsExportJob, DownloadOption
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+EXPORT_CSV_CHUNK_SIZE = 64 * 1024
+EXPORT_ROW_GROUP_SIZE = int(os.getenv('EXPORT_ROW_GROUP_SIZE', 10000))
+EXPORT_FILE_FORMATS = ['xlsx', 'csv', 'parquet', 'arrow']
+# one row per training, or one row per (training, cycle)
+EXPORT_LAYOUTS = ['training', 'cycle']
+EXPORT_MEDIA_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file'
+}
+
+EXPORT_JOB_WORKERS = int(os.getenv('EXPORT_JOB_WORKERS', 2))
+# jobs still pending or running this long after they were created were orphaned by a restart or a crashed worker
+EXPORT_JOB_TIMEOUT_MINUTES = int(os.getenv('EXPORT_JOB_TIMEOUT_MINUTES', 30))
+
+EXPORT_JOB_PENDING = 'pending'
+EXPORT_JOB_RUNNING = 'running'
+EXPORT_JOB_DONE = 'done'
+EXPORT_JOB_FAILED = 'failed'
+EXPORT_JOB_ACTIVE = (EXPORT_JOB_PENDING, EXPORT_JOB_RUNNING)
+
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_JOB_WORKERS, thread_name_prefix='trainings-export')
+
+
+class ExportColumn(NamedTuple):
+    name: str
+    # SQL expression selected for the column, constant columns have none
+    expression: Any = None
+    value: Any = None
+    join_user: bool = False
+    arrow_type: Any = pa.string()
+
+
+# in export order, names match the DownloadOption flags
+# TODO 쓸데없이 고정 데이터 넣은거 제거
+EXPORT_COLUMNS = [
+    ExportColumn('email', User.email, join_user=True),
+    ExportColumn('datetime', Training.date, arrow_type=pa.timestamp('s')),
+    ExportColumn('username', User.name, join_user=True),
+    ExportColumn('score', Training.score, arrow_type=pa.int64()),
+    ExportColumn('overall_ccf', Training.result[('score', 'ccf')], arrow_type=pa.float64()),
+    ExportColumn('overall_recoil', Training.result[('score', 'compression_recoil')], arrow_type=pa.float64()),
+    ExportColumn('overall_hand_position', Training.result[('score', 'handposition')], arrow_type=pa.float64()),
+    ExportColumn('overall_compression_depth', Training.result[('score', 'compression_depth')],
+                 arrow_type=pa.float64()),
+    ExportColumn('overall_compression_rate', Training.result[('score', 'compression_rate')], arrow_type=pa.float64()),
+    ExportColumn('overall_ventilation_rate', Training.result[('score', 'ventilation_rate')], arrow_type=pa.float64()),
+    ExportColumn('overall_ventilation_volume', Training.result[('score', 'ventilation_volume')],
+                 arrow_type=pa.float64()),
+    ExportColumn('judge_result', Training.result['is_passed'], arrow_type=pa.bool_()),
+    ExportColumn('manikin_model', value='Adult'),
+    ExportColumn('event_time', value='2024-01-09'),
+    ExportColumn('compression_number', value=90, arrow_type=pa.int64()),
+    ExportColumn('overall_ventilation_speed', value=90, arrow_type=pa.int64()),
+    ExportColumn('target', value='SDL'),
+    ExportColumn('device_id', value='s11se1'),
+    ExportColumn('name', value='skfn'),
+    ExportColumn('average_volume', value=80, arrow_type=pa.int64()),
+    ExportColumn('average_hands_off_time', value=82, arrow_type=pa.int64()),
+    ExportColumn('average_compression_rate', value=77, arrow_type=pa.int64()),
+    ExportColumn('average_compression_depth', value=73, arrow_type=pa.int64()),
+    ExportColumn('cycle_number', value=3, arrow_type=pa.int64()),
+    ExportColumn('percentage_ccf', value=90, arrow_type=pa.int64()),
+]
+
+# keys of result['score']['by_cycle'] entries
+BY_CYCLE_METRICS = ['total', 'ccf', 'compression_recoil', 'compression_depth', 'compression_rate',
+                    'ventilation_volume', 'ventilation_rate', 'handposition']
+BY_CYCLE_EXPRESSION = Training.result[('score', 'by_cycle')]
+
+
+# selected export columns compiled into one SQL projection and a row builder
+class ColumnPlan:
+    def __init__(self, columns: list):
+        self.columns = columns
+        self.names = [c.name for c in columns]
+        self.expressions = [c.expression.label(c.name) for c in columns if c.expression is not None]
+        self.join_user = any(c.join_user for c in columns)
+
+        # each output value is either a position in the selected row or a constant
+        extractors = []
+        position = 0
+        for c in columns:
+            if c.expression is not None:
+                extractors.append((True, position))
+                position += 1
+            else:
+                extractors.append((False, c.value))
+        self._extractors = extractors
+
+    def select(self, organization_id: int = None):
+        query = select(*self.expressions) if self.expressions else select(Training.id)
+        query = query.select_from(Training)
+        if self.join_user or organization_id:
+            query = query.join(User, User.id == Training.user_id)
+        if organization_id:
+            query = query.where(User.organization_id == organization_id)
+        return query
+
+    def build_rows(self, rows: Iterable):
+        extractors = self._extractors
+        for row in rows:
+            yield [row[v] if selected else v for selected, v in extractors]
+
+    @property
+    def arrow_schema(self):
+        fields = [pa.field(c.name, c.arrow_type) for c in self.columns]
+        fields += [pa.field(f'by_cycle_{metric}', pa.list_(pa.float64())) for metric in BY_CYCLE_METRICS]
+        return pa.schema(fields)
+
+    @property
+    def cycle_names(self):
+        return ['training_id'] + self.names + ['cycle'] + [f'cycle_{metric}' for metric in BY_CYCLE_METRICS]
+
+    @property
+    def cycle_arrow_schema(self):
+        fields = [pa.field('training_id', pa.int64())]
+        fields += [pa.field(c.name, c.arrow_type) for c in self.columns]
+        fields += [pa.field('cycle', pa.int64())]
+        fields += [pa.field(f'cycle_{metric}', pa.float64()) for metric in BY_CYCLE_METRICS]
+        return pa.schema(fields)
+
+    def build_cycle_frame(self, rows: list):
+        # the training id and by_cycle document are selected after the plan's own columns
+        trainings = pd.DataFrame(list(self.build_rows(rows)), columns=self.names)
+        lengths, cycles = flatten_by_cycle([row[-1] for row in rows])
+
+        # repeat each training once per cycle and number its cycles from 1
+        frame = trainings.iloc[np.repeat(np.arange(len(rows)), lengths)].reset_index(drop=True)
+        frame.insert(0, 'training_id', np.repeat(np.array([row[-2] for row in rows], dtype=np.int64), lengths))
+        frame['cycle'] = np.arange(len(frame)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + 1
+        cycles.columns = [f'cycle_{metric}' for metric in BY_CYCLE_METRICS]
+        return pd.concat([frame, cycles], axis=1)
+
+    def build_cycle_record_batch(self, frame):
+        schema = self.cycle_arrow_schema
+        arrays = [to_arrow_array(frame[field.name].to_numpy(dtype=object), field.type) for field in schema]
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def build_record_batch(self, rows: list):
+        # the by_cycle document is selected after the plan's own columns
+        columns = list(zip(*self.build_rows(rows))) if rows else [()] * len(self.columns)
+        arrays = [to_arrow_array(values, c.arrow_type) for values, c in zip(columns, self.columns)]
+
+        lengths, cycles = flatten_by_cycle([row[-1] for row in rows])
+        offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]), type=pa.int32())
+        for metric in BY_CYCLE_METRICS:
+            values = pa.array(cycles[metric].to_numpy(dtype=np.float64), from_pandas=True)
+            arrays.append(pa.ListArray.from_arrays(offsets, values))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.arrow_schema)
+
+
+def to_arrow_array(values, arrow_type):
+    if pa.types.is_floating(arrow_type) or pa.types.is_integer(arrow_type):
+        # analysis results use strings such as "Not Applicable" for missing scores
+        numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce')
+        return pa.array(numbers.to_numpy(dtype=np.float64), from_pandas=True).cast(arrow_type)
+    if pa.types.is_boolean(arrow_type):
+        return pa.array([None if v is None else bool(v) for v in values], type=arrow_type)
+    return pa.array(values, type=arrow_type)
+
+
+def flatten_by_cycle(by_cycle_values: list):
+    # one row per cycle for a whole batch of trainings, plus the cycle count of each training
+    by_cycle_values = [v or [] for v in by_cycle_values]
+    lengths = np.fromiter(map(len, by_cycle_values), dtype=np.int64, count=len(by_cycle_values))
+    cycles = pd.DataFrame.from_records(list(chain.from_iterable(by_cycle_values)), columns=BY_CYCLE_METRICS)
+    return lengths, cycles.apply(pd.to_numeric, errors='coerce')
+
+
+@lru_cache(maxsize=256)
+def compile_column_plan(options: int):
+    return ColumnPlan([c for c in EXPORT_COLUMNS if options & DownloadOption[c.name.upper()]])
+
+
+def iterate_training_records(query):
+    # server side cursor, only EXPORT_BATCH_SIZE rows are held in memory at a time
+    db = SessionLocal()
+    try:
+        yield from db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    finally:
+        db.close()
+
+
+def store_training_data_to_excel(training_data: Iterable[list], column: list):
+    # write-only workbook streams rows to the zip file instead of keeping the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(column)
+    for data in training_data:
+        sheet.append(data)
+    with NamedTemporaryFile(suffix='.xlsx', delete=False) as f:
+        workbook.save(f)
+    return f.name
+
+
+def stream_training_data_to_csv(training_data: Iterable[list], column: list):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(column)
+    for data in training_data:
+        writer.writerow(data)
+        if buffer.tell() >= EXPORT_CSV_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iterate_batches(rows: Iterable, size: int):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def store_training_data_to_arrow(plan: ColumnPlan, query, file_format: str):
+    # each batch becomes one parquet row group / arrow record batch, so memory is bounded by the batch size
+    rows = iterate_training_records(query.add_columns(BY_CYCLE_EXPRESSION.label('by_cycle')))
+    with NamedTemporaryFile(suffix=f'.{file_format}', delete=False) as f:
+        if file_format == 'parquet':
+            writer = pq.ParquetWriter(f, plan.arrow_schema)
+        else:
+            writer = pa.ipc.new_file(f, plan.arrow_schema)
+        with writer:
+            for batch in iterate_batches(rows, EXPORT_ROW_GROUP_SIZE):
+                writer.write_batch(plan.build_record_batch(batch))
+    return f.name
+
+
+def iterate_cycle_frames(plan: ColumnPlan, query, size: int):
+    query = query.add_columns(Training.id.label('cycle_training_id'), BY_CYCLE_EXPRESSION.label('by_cycle'))
+    for batch in iterate_batches(iterate_training_records(query), size):
+        yield plan.build_cycle_frame(batch)
+
+
+def iterate_frame_rows(frames: Iterable):
+    for frame in frames:
+        yield from frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+
+
+def stream_cycle_data_to_csv(plan: ColumnPlan, query):
+    buffer = StringIO()
+    csv.writer(buffer).writerow(plan.cycle_names)
+    yield buffer.getvalue()
+    for frame in iterate_cycle_frames(plan, query, EXPORT_BATCH_SIZE):
+        yield frame.to_csv(index=False, header=False)
+
+
+def store_cycle_data(plan: ColumnPlan, query, file_format: str):
+    if file_format == 'xlsx':
+        rows = iterate_frame_rows(iterate_cycle_frames(plan, query, EXPORT_BATCH_SIZE))
+        return store_training_data_to_excel(rows, plan.cycle_names)
+
+    if file_format == 'csv':
+        with NamedTemporaryFile('w', suffix='.csv', delete=False, newline='') as f:
+            for chunk in stream_cycle_data_to_csv(plan, query):
+                f.write(chunk)
+        return f.name
+
+    with NamedTemporaryFile(suffix=f'.{file_format}', delete=False) as f:
+        if file_format == 'parquet':
+            writer = pq.ParquetWriter(f, plan.cycle_arrow_schema)
+        else:
+            writer = pa.ipc.new_file(f, plan.cycle_arrow_schema)
+        with writer:
+            for frame in iterate_cycle_frames(plan, query, EXPORT_ROW_GROUP_SIZE):
+                writer.write_batch(plan.build_cycle_record_batch(frame))
+    return f.name
+
+
+def write_export_file(plan: ColumnPlan, query, file_format: str, layout: str = 'training'):
+    if layout == 'cycle':
+        return store_cycle_data(plan, query, file_format)
+
+    if file_format in ['parquet', 'arrow']:
+        return store_training_data_to_arrow(plan, query, file_format)
+
+    data = plan.build_rows(iterate_training_records(query))
+    if file_format == 'csv':
+        with NamedTemporaryFile('w', suffix='.csv', delete=False, newline='') as f:
+            for chunk in stream_training_data_to_csv(data, plan.names):
+                f.write(chunk)
+        return f.name
+    return store_training_data_to_excel(data, plan.names)
+
+
+def get_export_data_version(query, db: Session):
+    # changes whenever a training is added to (or removed from) the exported range
+    exported = query.add_columns(Training.id.label('version_training_id')).order_by(None).subquery()
+    version_query = select(func.count(), func.max(exported.c.version_training_id))
+    count, last_id = db.execute(version_query).one()
+    return [count, last_id]
+
+
+def make_export_job_key(organization_id: int, start_date: str, end_date: str, plan: ColumnPlan, file_format: str,
+                        layout: str, version: list):
+    key = json.dumps([organization_id, start_date, end_date, plan.names, file_format, layout, version])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def store_export_artifact(path: str, file_name: str):
+    key = f'exports/{file_name}'
+    try:
+        with open(path, 'rb') as f:
+            if not file_storage.put(key, f):
+                raise RuntimeError('storage is not available')
+    finally:
+        os.remove(path)
+    return key
+
+
+def export_artifact_exists(job: TrainingsExportJob):
+    return file_storage.exists(job.artifact_key)
+
+
+def get_export_artifact_url(job: TrainingsExportJob):
+    return file_storage.url(job.artifact_key)
+
+
+def is_export_job_stale(job: TrainingsExportJob):
+    return (job.status in EXPORT_JOB_ACTIVE and job.created_at is not None
+            and job.created_at < datetime.now() - timedelta(minutes=EXPORT_JOB_TIMEOUT_MINUTES))
+
+
+def run_export_job(job_id: int, plan: ColumnPlan, query, layout: str):
+    db = SessionLocal()
+    try:
+        job = db.get(TrainingsExportJob, job_id)
+        job.status = EXPORT_JOB_RUNNING
+        db.commit()
+        try:
+            path = write_export_file(plan, query, job.file_format, layout)
+            job.artifact_key = store_export_artifact(path, f'{job.cache_key}.{job.file_format}')
+            job.status = EXPORT_JOB_DONE
+        except Exception as e:
+            logging.error(e)
+            job.status = EXPORT_JOB_FAILED
+        job.finished_at = datetime.now()
+        db.commit()
+    finally:
+        db.close()
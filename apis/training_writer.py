@@ -0,0 +1,87 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from database import SessionLocal
+
+TRAINING_GROUP_COMMIT = os.getenv('TRAINING_GROUP_COMMIT', 'false').lower() == 'true'
+TRAINING_GROUP_COMMIT_MAX_BATCH = int(os.getenv('TRAINING_GROUP_COMMIT_MAX_BATCH', 64))
+TRAINING_GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv('TRAINING_GROUP_COMMIT_MAX_DELAY_MS', 5))
+
+
+# rows from concurrent requests inserted one by one and written with one shared commit per batch
+class GroupCommitWriter:
+    def __init__(self, session_factory, max_batch: int, max_delay: float):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='training-group-commit', daemon=True)
+                self._thread.start()
+
+    def submit(self, rows: list):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((rows, future))
+        return future
+
+    def write(self, rows: list):
+        # blocks the calling (worker) thread until the batch holding these rows is committed
+        return self.submit(rows).result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: list):
+        error = self._commit([rows for rows, _ in batch])
+        if error is None:
+            for rows, future in batch:
+                future.set_result(rows)
+            return
+
+        if len(batch) == 1:
+            batch[0][1].set_exception(error)
+            return
+
+        # one bad submission must not fail the others, fall back to committing them one by one
+        logging.error(error)
+        for item in batch:
+            self._flush([item])
+
+    def _commit(self, batch_rows: list):
+        db = self.session_factory(expire_on_commit=False)
+        try:
+            for rows in batch_rows:
+                db.add_all(rows)
+            db.commit()
+            return None
+        except Exception as e:
+            # rollback expunges the pending rows so they can be retried in another session
+            db.rollback()
+            return e
+        finally:
+            db.close()
+
+
+training_writer = GroupCommitWriter(SessionLocal, TRAINING_GROUP_COMMIT_MAX_BATCH,
+                                    TRAINING_GROUP_COMMIT_MAX_DELAY_MS / 1000)
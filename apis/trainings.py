@@ -1,29 +1,63 @@
 import json
-from datetime import datetime
+import logging
+import os
+import time
+from datetime import datetime, timedelta
 
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status, Request, UploadFile, Form
-from fastapi.responses import FileResponse
-
-import requests
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse, RedirectResponse
+from starlette.background import BackgroundTask
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy.sql import select, func
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import select, func, update, delete, and_
 
 from pydantic import BaseModel
 
-from pandas import DataFrame, Timestamp
-
+from pandas import Timestamp
+
+from apis.analysis import request_sequence_analysis, analysis_cache, TRAINING_UPLOAD_MAX_BYTES
+from apis.certification import enqueue_certificate_render, CERTIFICATE_VALIDITY
+from apis.util import get_token_by_header, get_user_by_token, check_admin_authorized_by_user, get_file_size
+from apis.training_writer import training_writer, TRAINING_GROUP_COMMIT
+from apis.training_export import compile_column_plan, iterate_training_records, write_export_file, \
+    stream_training_data_to_csv, stream_cycle_data_to_csv, get_export_data_version, make_export_job_key, \
+    export_artifact_exists, get_export_artifact_url, run_export_job, export_executor, EXPORT_FILE_FORMATS, \
+    EXPORT_LAYOUTS, EXPORT_MEDIA_TYPES, EXPORT_JOB_PENDING, EXPORT_JOB_DONE, EXPORT_JOB_FAILED, \
+    EXPORT_JOB_TIMEOUT_MINUTES, is_export_job_stale
 from database import get_db
+from exceptions import GetExceptionWithStatuscode
+from lru import LRUCache
 from models import User, TrainingProgram
-from models.model import Training, TrainingsDownloadOptions, Certification
-from schema.trainings import TrainingResultResponseSchema, TrainingListSchema, TrainingResponseSchema
+from models.model import Training, TrainingsDownloadOptions, Certification, TrainingIdempotencyKey, \
+    TrainingsExportJob, DownloadOption, DEFAULT_DOWNLOAD_OPTIONS
+from schema.trainings import TrainingResultResponseSchema, TrainingListSchema, TrainingResponseSchema, \
+    ExportJobResponseSchema
 
 router = APIRouter(prefix='/trainings')
 
 per_page = 30
 
+# option endpoints of this process update the cache, other workers pick changes up after the ttl
+DOWNLOAD_OPTIONS_CACHE_TTL = float(os.getenv('DOWNLOAD_OPTIONS_CACHE_TTL', 60))
+DOWNLOAD_OPTIONS_CACHE_MAX_ENTRIES = int(os.getenv('DOWNLOAD_OPTIONS_CACHE_MAX_ENTRIES', 1024))
+
+IDEMPOTENCY_KEY = 'Idempotency-Key'
+IDEMPOTENCY_KEY_MAX_LENGTH = TrainingIdempotencyKey.key.type.length
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', 30))
+IDEMPOTENCY_POLL_INTERVAL = 0.2
+# a key still without response this long after it was claimed belongs to a request that is gone
+IDEMPOTENCY_LEASE = float(os.getenv('IDEMPOTENCY_LEASE', IDEMPOTENCY_WAIT_TIMEOUT))
+
+
+# download option bitmasks by user id
+download_options_cache = LRUCache(DOWNLOAD_OPTIONS_CACHE_MAX_ENTRIES, ttl=DOWNLOAD_OPTIONS_CACHE_TTL)
+
 
 class CreateRequestSchema(BaseModel):
     training_program_id: int
@@ -53,28 +87,116 @@ def is_training(training_mode: str):
     return False
 
 
-def store_issued_certificate_information(training_id: int, user_id: int, db: Session = Depends(get_db)):
-    certification = Certification(user_id=user_id, training_id=training_id)
-    db.add(certification)
-    db.commit()
-    db.refresh(certification)
-    return certification
+def store_issued_certificate_information(training: Training, user_id: int):
+    # saved together with the training by save_training_rows
+    issued_date = datetime.now()
+    return Certification(user_id=user_id, training=training, issued_date=issued_date,
+                         expires_at=issued_date + CERTIFICATE_VALIDITY)
 
 
 # TODO issue certificate send email
-def issue_certificate():
-    pass
+def issue_certificate(certification: Optional[Certification]):
+    # called once the certification is committed, the pdf is rendered in the background
+    if certification:
+        enqueue_certificate_render(certification.id)
+
+
+def claim_idempotency_key(key: str, user_id: int, db: Session = Depends(get_db)):
+    # returns the stored response when the key was already used, None when this request owns the key.
+    # blocks while another request owns it, run it in the threadpool
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+    while True:
+        try:
+            db.add(TrainingIdempotencyKey(key=key, user_id=user_id, created_at=datetime.now()))
+            db.commit()
+            return None
+        except IntegrityError:
+            db.rollback()
+
+        # wait for the request that owns the key to finish
+        while True:
+            idempotency_key = db.get(TrainingIdempotencyKey, (key, user_id), populate_existing=True)
+            # end the read transaction so the next poll sees other sessions' commits
+            db.rollback()
+            if not idempotency_key:
+                # owner failed and released the key
+                break
+            if idempotency_key.response is not None:
+                return idempotency_key.response
+            if idempotency_key.created_at < datetime.now() - timedelta(seconds=IDEMPOTENCY_LEASE):
+                # owner crashed or could not release the key, take it over unless another request was faster
+                query = (update(TrainingIdempotencyKey)
+                         .where(and_(TrainingIdempotencyKey.key == key, TrainingIdempotencyKey.user_id == user_id,
+                                     TrainingIdempotencyKey.response.is_(None),
+                                     TrainingIdempotencyKey.created_at == idempotency_key.created_at))
+                         .values(created_at=datetime.now()))
+                taken_over = db.execute(query).rowcount == 1
+                db.commit()
+                if taken_over:
+                    return None
+                continue
+            if time.monotonic() > deadline:
+                raise HTTPException(status.HTTP_409_CONFLICT,
+                                    detail='a request with this idempotency key is still in progress')
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+
+def release_idempotency_key(key: str, user_id: int, db: Session = Depends(get_db)):
+    db.rollback()
+    db.execute(delete(TrainingIdempotencyKey).where(and_(TrainingIdempotencyKey.key == key,
+                                                         TrainingIdempotencyKey.user_id == user_id)))
+    db.commit()
 
 
 @router.post('', status_code=status.HTTP_201_CREATED)
 async def create_training(request: Request, training_data: CreateRequestSchema = Depends(CreateRequestSchema.as_form),
                           db: Session = Depends(get_db)):
+    db.expire_on_commit = False
     token = request.headers["Authorization"]
-    timestamp = Timestamp(datetime.now())
     # get user by token
     query = select(User).where(User.token == token)
     user = db.scalar(query)
 
+    if get_file_size(training_data.rawHexBPfile.file) > TRAINING_UPLOAD_MAX_BYTES:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='recording file is too large')
+
+    idempotency_key = request.headers.get(IDEMPOTENCY_KEY)
+    if not idempotency_key:
+        result, certification = await run_in_threadpool(store_training_result, user, training_data, db)
+        db.commit()
+        issue_certificate(certification)
+        return result
+
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                            detail=f'idempotency key is longer than {IDEMPOTENCY_KEY_MAX_LENGTH} characters')
+
+    stored_response = await run_in_threadpool(claim_idempotency_key, idempotency_key, user.id, db)
+    if stored_response is not None:
+        return stored_response
+
+    try:
+        # the training has to be committed together with the stored response, never by the group commit writer,
+        # otherwise a failure after the write would release the key of a training that already exists
+        result, certification = await run_in_threadpool(store_training_result, user, training_data, db, False)
+        response = jsonable_encoder(result)
+        query = (update(TrainingIdempotencyKey)
+                 .where(and_(TrainingIdempotencyKey.key == idempotency_key, TrainingIdempotencyKey.user_id == user.id))
+                 .values(training_id=result.id, response=response))
+        db.execute(query)
+        db.commit()
+    except Exception:
+        release_idempotency_key(idempotency_key, user.id, db)
+        raise
+    issue_certificate(certification)
+    return response
+
+
+def store_training_result(user: User, training_data: CreateRequestSchema, db: Session = Depends(get_db),
+                          group_commit: bool = TRAINING_GROUP_COMMIT):
+    # the training and its certificate are only flushed, the caller commits them in one transaction
+    # unless they go through the group commit writer
+    timestamp = Timestamp(datetime.now())
     # get training program
     query = (select(TrainingProgram).options(joinedload(TrainingProgram.cpr_guideline))
              .where(TrainingProgram.id == training_data.training_program_id))
@@ -93,12 +215,7 @@ async def create_training(request: Request, training_data: CreateRequestSchema =
         data["Custom"]["TrainCourse"]["Type"] = get_calculate_type_from_training_type(training_program.training_type)
         data["Custom"]["TrainCourse"]["CardTitle"] = training_program.title
 
-    files = [('data', ('genk-adult-pass_train_condition.json', json.dumps(data), 'application/json')),
-             ('rawHexBPfile', ('genk-adult-pass_rawHexBPfile.bin', training_data.rawHexBPfile.file,
-                               'application/octet-stream'))]
-    response = requests.post("https://beta.braydenonline.cc/cpr-sequence-analysis",
-                             headers={}, files=files, data={})
-    response_data = json.loads(response.content)
+    response_data = request_sequence_analysis(data, training_data.rawHexBPfile.file, user.id)
     # make datetime
     create_epoch = datetime.fromtimestamp(response_data['Usage']['Timestamp'])
 
@@ -245,288 +362,196 @@ async def create_training(request: Request, training_data: CreateRequestSchema =
 
     trainings = Training(score=total_score, date=create_epoch, result=training_result_data,
                          data=json.loads(training_data.training_data), user_id=user.id,
-                         training_program_id=training_data.training_program_id)
-
-    db.add(trainings)
-    db.commit()
-    db.refresh(trainings)
+                         training_program_id=training_program.id)
+    rows = [trainings]
+    certification = None
     if training_program.training_mode == 'assessment' and response_data['ResultSummary']['JudgResult'] == 'Pass':
-        issue_certificate()
-        store_issued_certificate_information(trainings.id, user.id, db)
-    query = (select(Training).where(Training.id == trainings.id)
-             .options(joinedload(Training.user)).options(joinedload(Training.training_program)))
-
-    training_result = db.scalar(query)
-    return TrainingResultResponseSchema(training_result)
-
-
-def make_dataframe_from_list(data: list, column: list):
-    return DataFrame(data, columns=column)
-
-
-def store_training_data_to_excel(training_data: list, column: list):
-    file_name = 'training_records.xlsx'
-    # dataframe from model list
-    dataframe = make_dataframe_from_list(training_data, column)
-    # make excel
-    dataframe.to_excel(file_name)
-    return file_name
-
-
-def get_columns_from_options(option: TrainingsDownloadOptions):
-    column = []
-    if option.email:
-        column.append('email')
-    if option.datetime:
-        column.append('datetime')
-    if option.username:
-        column.append('username')
-    if option.score:
-        column.append('score')
-    if option.overall_ccf:
-        column.append('overall_ccf')
-    if option.overall_recoil:
-        column.append('overall_recoil')
-    if option.overall_hand_position:
-        column.append('overall_hand_position')
-    if option.overall_compression_depth:
-        column.append('overall_compression_depth')
-    if option.overall_compression_rate:
-        column.append('overall_compression_rate')
-    if option.overall_ventilation_rate:
-        column.append('overall_ventilation_rate')
-    if option.overall_ventilation_volume:
-        column.append('overall_ventilation_volume')
-    if option.judge_result:
-        column.append('judge_result')
-    if option.manikin_model:
-        column.append('manikin_model')
-    if option.event_time:
-        column.append('event_time')
-    if option.compression_number:
-        column.append('compression_number')
-    if option.overall_ventilation_speed:
-        column.append('overall_ventilation_speed')
-    if option.target:
-        column.append('target')
-    if option.device_id:
-        column.append('device_id')
-    if option.name:
-        column.append('name')
-    if option.average_volume:
-        column.append('average_volume')
-    if option.average_hands_off_time:
-        column.append('average_hands_off_time')
-    if option.average_compression_rate:
-        column.append('average_compression_rate')
-    if option.average_compression_depth:
-        column.append('average_compression_depth')
-    if option.cycle_number:
-        column.append('cycle_number')
-    if option.percentage_ccf:
-        column.append('percentage_ccf')
-
-    return column
-
-
-def choose_training_data_from_options(training_data: list, option: TrainingsDownloadOptions):
-    result = []
-    for data in training_data:
-        result_data = {}
-        # TODO 쓸데없이 고정 데이터 넣은거 제거
-        if option.email:
-            result_data['email'] = data.user.email
-        if option.datetime:
-            result_data['datetime'] = data.date
-        if option.username:
-            result_data['username'] = data.user.name
-        if option.score:
-            result_data['score'] = data.score
-        if option.overall_ccf:
-            result_data['overall_ccf'] = data.result['score']['ccf']
-        if option.overall_recoil:
-            result_data['overall_recoil'] = data.result['score']['compression_recoil']
-        if option.overall_hand_position:
-            result_data['overall_hand_position'] = data.result['score']['handposition']
-        if option.overall_compression_depth:
-            result_data['overall_compression_depth'] = data.result['score']['compression_depth']
-        if option.overall_compression_rate:
-            result_data['overall_compression_rate'] = data.result['score']['compression_rate']
-        if option.overall_ventilation_rate:
-            result_data['overall_ventilation_rate'] = data.result['score']['ventilation_rate']
-        if option.overall_ventilation_volume:
-            result_data['overall_ventilation_volume'] = data.result['score']['ventilation_volume']
-        if option.judge_result:
-            result_data['judge_result'] = data.result['is_passed']
-        if option.manikin_model:
-            result_data['manikin_model'] = 'Adult'
-        if option.event_time:
-            result_data['event_time'] = '2024-01-09'
-        if option.compression_number:
-            result_data['compression_number'] = 90
-        if option.overall_ventilation_speed:
-            result_data['overall_ventilation_speed'] = 90
-        if option.target:
-            result_data['target'] = 'SDL'
-        if option.device_id:
-            result_data['device_id'] = 's11se1'
-        if option.name:
-            result_data['name'] = 'skfn'
-        if option.average_volume:
-            result_data['average_volume'] = 80
-        if option.average_hands_off_time:
-            result_data['average_hands_off_time'] = 82
-        if option.average_compression_rate:
-            result_data['average_compression_rate'] = 77
-        if option.average_compression_depth:
-            result_data['average_compression_depth'] = 73
-        if option.cycle_number:
-            result_data['cycle_number'] = 3
-        if option.percentage_ccf:
-            result_data['percentage_ccf'] = 90
-        result.append(result_data)
-    return result
+        certification = store_issued_certificate_information(trainings, user.id)
+        rows.append(certification)
+    save_training_rows(rows, db, group_commit)
 
+    # response is built from the objects already loaded in this session
+    set_committed_value(trainings, 'user', user)
+    set_committed_value(trainings, 'training_program', training_program)
+    # the caller issues the certificate once its transaction is committed
+    return TrainingResultResponseSchema(trainings), certification
 
-@router.get('/download')
-async def download_file(request: Request, start_date: str = None, end_date: str = None, db: Session = Depends(get_db)):
+
+def save_training_rows(rows: list, db: Session = Depends(get_db), group_commit: bool = TRAINING_GROUP_COMMIT):
+    if group_commit:
+        # committed together with other requests' rows by the group commit writer
+        training_writer.write(rows)
+        return
+    db.add_all(rows)
+    db.flush()
+
+
+def get_download_user(request: Request, db: Session = Depends(get_db)):
     token = request.headers['Authorization']
     user_select_query = select(User).where(User.token == token)
     user = db.scalar(user_select_query)
     if not user:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="invalid token")
+    return user
+
+
+def get_download_options_by_user(user: User, db: Session = Depends(get_db)):
+    # returns the option bitmask, only the first read per user touches the database
+    options = download_options_cache.get(user.id)
+    if options is not None:
+        return options
 
-    options = db.query(TrainingsDownloadOptions).get(user.id)
-    if not options:
+    download_options = db.get(TrainingsDownloadOptions, user.id)
+    if not download_options:
         # create options
-        options = TrainingsDownloadOptions(user_id=user.id)
-        db.add(options)
+        download_options = TrainingsDownloadOptions(user_id=user.id, options=DEFAULT_DOWNLOAD_OPTIONS)
+        db.add(download_options)
         db.commit()
-        db.refresh(options)
+    download_options_cache.put(user.id, download_options.options)
+    return download_options.options
 
-    query = (select(Training)
-             .options(joinedload(Training.training_program).joinedload(TrainingProgram.cpr_guideline))
-             .options(joinedload(Training.user)))
 
+def convert_download_options_to_dict(user_id: int, options: int):
+    return {'user_id': user_id, **DownloadOption.to_dict(options)}
+
+
+def where_training_date(query, start_date: str = None, end_date: str = None):
     if start_date:
         datetime_start_date = start_date_to_datetime(start_date)
         query = query.where(Training.date >= datetime_start_date)
     if end_date:
         datetime_end_date = end_date_to_datetime(end_date)
         query = query.where(Training.date <= datetime_end_date)
+    return query
+
+
+def select_export_trainings(plan, user: User, start_date: str = None, end_date: str = None):
+    # shared by the synchronous download and the export jobs, both only export the user's organization
+    return where_training_date(plan.select(user.organization_id), start_date, end_date)
+
+
+def check_export_file_format(file_format: str, layout: str):
+    if file_format not in EXPORT_FILE_FORMATS:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="unsupported file format")
+    if layout not in EXPORT_LAYOUTS:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="unsupported layout")
+
+
+@router.get('/download')
+async def download_file(request: Request, start_date: str = None, end_date: str = None, file_format: str = 'xlsx',
+                        layout: str = 'training', db: Session = Depends(get_db)):
+    user = get_download_user(request, db)
+    check_export_file_format(file_format, layout)
+    options = get_download_options_by_user(user, db)
 
-    query = query.order_by(Training.id.desc())
-    training_data = db.scalars(query).all()
     # choose training history from option
-    column = get_columns_from_options(options)
-    data = choose_training_data_from_options(training_data, options)
+    plan = compile_column_plan(options)
+    query = select_export_trainings(plan, user, start_date, end_date).order_by(Training.id.desc())
+    if file_format == 'csv':
+        if layout == 'cycle':
+            content = stream_cycle_data_to_csv(plan, query)
+        else:
+            content = stream_training_data_to_csv(plan.build_rows(iterate_training_records(query)), plan.names)
+        return StreamingResponse(content, media_type='text/csv',
+                                 headers={'Content-Disposition': 'attachment; filename="records.csv"'})
+
+    file_name = await run_in_threadpool(write_export_file, plan, query, file_format, layout)
+    return FileResponse(file_name, filename=f"records.{file_format}", media_type=EXPORT_MEDIA_TYPES[file_format],
+                        background=BackgroundTask(os.remove, file_name))
+
+
+@router.post('/download/jobs', status_code=status.HTTP_202_ACCEPTED, response_model=ExportJobResponseSchema)
+def create_download_job(request: Request, start_date: str = None, end_date: str = None, file_format: str = 'xlsx',
+                        layout: str = 'training', db: Session = Depends(get_db)):
+    user = get_download_user(request, db)
+    check_export_file_format(file_format, layout)
+    options = get_download_options_by_user(user, db)
+
+    plan = compile_column_plan(options)
+    query = select_export_trainings(plan, user, start_date, end_date)
+    version = get_export_data_version(query, db)
+    cache_key = make_export_job_key(user.organization_id, start_date, end_date, plan, file_format, layout, version)
+
+    # identical request with no new trainings in the range reuses the artifact
+    job_select_query = (select(TrainingsExportJob)
+                        .where(and_(TrainingsExportJob.cache_key == cache_key,
+                                    TrainingsExportJob.status != EXPORT_JOB_FAILED))
+                        .order_by(TrainingsExportJob.id.desc()))
+    job = db.scalar(job_select_query)
+    if job and is_export_job_stale(job):
+        # nobody is working on it anymore, fail it and start over
+        logging.warning(f'export job {job.id} is still {job.status} after {EXPORT_JOB_TIMEOUT_MINUTES} minutes')
+        job.status = EXPORT_JOB_FAILED
+        job.finished_at = datetime.now()
+        db.commit()
+        job = None
+    if job and (job.status != EXPORT_JOB_DONE or export_artifact_exists(job)):
+        return job
+
+    job = TrainingsExportJob(cache_key=cache_key, status=EXPORT_JOB_PENDING, file_format=file_format,
+                             user_id=user.id, organization_id=user.organization_id)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    export_executor.submit(run_export_job, job.id, plan, query.order_by(Training.id.desc()), layout)
+    return job
+
+
+def get_download_job_by_user(job_id: int, user: User, db: Session = Depends(get_db)):
+    job_select_query = select(TrainingsExportJob).where(and_(TrainingsExportJob.id == job_id,
+                                                             TrainingsExportJob.organization_id == user.organization_id))
+    job = db.scalar(job_select_query)
+    if not job:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="there is no export job")
+    return job
 
-    file_name = store_training_data_to_excel(data, column)
-    return FileResponse(file_name, filename="records.xlsx")
+
+@router.get('/download/jobs/{job_id}', response_model=ExportJobResponseSchema)
+def get_download_job(job_id: int, request: Request, db: Session = Depends(get_db)):
+    user = get_download_user(request, db)
+    return get_download_job_by_user(job_id, user, db)
+
+
+@router.get('/download/jobs/{job_id}/file')
+def download_job_file(job_id: int, request: Request, db: Session = Depends(get_db)):
+    user = get_download_user(request, db)
+    job = get_download_job_by_user(job_id, user, db)
+    if job.status != EXPORT_JOB_DONE:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail="export job is not finished")
+
+    return RedirectResponse(get_export_artifact_url(job))
 
 
 @router.post('/download/options')
 def add_download_options(options: dict, request: Request, db: Session = Depends(get_db)):
-    token = request.headers['Authorization']
-    user_select_query = select(User).where(User.token == token)
-    user = db.scalar(user_select_query)
-    if not user:
-        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="invalid token")
+    user = get_download_user(request, db)
 
-    download_options = TrainingsDownloadOptions(user_id=user.id, email=options['email'], score=options['score'],
-                                                username=options['username'], datetime=options['datetime'],
-                                                average_compression_depth=options['average_compression_depth'],
-                                                average_hands_off_time=options['average_hands_off_time'],
-                                                compression_number=options['compression_number'],
-                                                event_time=options['event_time'],
-                                                manikin_model=options['manikin_model'],
-                                                overall_ccf=options['overall_ccf'],
-                                                overall_compression_no=options['overall_compression_no'],
-                                                overall_hand_position=options['overall_hand_position'],
-                                                overall_ventilation_rate=options['overall_ventilation_rate'],
-                                                overall_ventilation_volume=options['overall_ventilation_volume'],
-                                                average_compression_rate=options['average_compression_rate'],
-                                                average_volume=options['average_volume'],
-                                                cycle_number=options['cycle_number'],
-                                                judge_result=options['judge_result'],
-                                                overall_compression_depth=options['overall_compression_depth'],
-                                                overall_compression_rate=options['overall_compression_rate'],
-                                                overall_recoil=options['overall_recoil'],
-                                                overall_ventilation_speed=options['overall_ventilation_speed'],
-                                                percentage_ccf=options['percentage_ccf'],
-                                                target=options['target'],
-                                                type=options['type'],
-                                                device_id=options['device_id'],
-                                                name=options['name']
-                                                )
+    download_options = TrainingsDownloadOptions(user_id=user.id,
+                                                options=DownloadOption.from_dict(options, DEFAULT_DOWNLOAD_OPTIONS))
     db.add(download_options)
     db.commit()
-    db.refresh(download_options)
-    return download_options
+    download_options_cache.put(user.id, download_options.options)
+    return convert_download_options_to_dict(user.id, download_options.options)
 
 
 @router.get('/download/options')
 def get_download_options(request: Request, db: Session = Depends(get_db)):
-    token = request.headers['Authorization']
-    user_select_query = select(User).where(User.token == token)
-    user = db.scalar(user_select_query)
-    if not user:
-        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="invalid token")
-
-    option_select_query = select(TrainingsDownloadOptions).where(user.id == TrainingsDownloadOptions.user_id)
-    options = db.scalar(option_select_query)
-    if not options:
-        new_options = TrainingsDownloadOptions(user_id=user.id)
-        db.add(new_options)
-        db.commit()
-        db.refresh(new_options)
-        return new_options
-
-    return options
+    user = get_download_user(request, db)
+    return convert_download_options_to_dict(user.id, get_download_options_by_user(user, db))
 
 
 @router.put('/download/options')
 def update_download_options(options_param: dict, request: Request, db: Session = Depends(get_db)):
-    token = request.headers['Authorization']
-    user_select_query = select(User).where(User.token == token)
-    user = db.scalar(user_select_query)
-    if not user:
-        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="invalid token")
+    user = get_download_user(request, db)
 
-    option_select_query = select(TrainingsDownloadOptions).where(user.id == TrainingsDownloadOptions.user_id)
-    options = db.scalar(option_select_query)
-    options.user_id = user.id
-    options.email = options_param['email']
-    options.score = options_param['score']
-    options.username = options_param['username']
-    options.datetime = options_param['datetime']
-    options.average_compression_depth = options_param['average_compression_depth']
-    options.average_hands_off_time = options_param['average_hands_off_time']
-    options.compression_number = options_param['compression_number']
-    options.event_time = options_param['event_time']
-    options.manikin_model = options_param['manikin_model']
-    options.overall_ccf = options_param['overall_ccf']
-    options.overall_compression_no = options_param['overall_compression_no']
-    options.overall_hand_position = options_param['overall_hand_position']
-    options.overall_ventilation_rate = options_param['overall_ventilation_rate']
-    options.overall_ventilation_volume = options_param['overall_ventilation_volume']
-    options.average_compression_rate = options_param['average_compression_rate']
-    options.average_volume = options_param['average_volume']
-    options.cycle_number = options_param['cycle_number']
-    options.judge_result = options_param['judge_result']
-    options.overall_compression_depth = options_param['overall_compression_depth']
-    options.overall_compression_rate = options_param['overall_compression_rate']
-    options.overall_recoil = options_param['overall_recoil']
-    options.overall_ventilation_speed = options_param['overall_ventilation_speed']
-    options.percentage_ccf = options_param['percentage_ccf']
-    options.target = options_param['target']
-    options.type = options_param['type']
-
-    db.add(options)
+    options = DownloadOption.from_dict(options_param, get_download_options_by_user(user, db))
+    query = (update(TrainingsDownloadOptions).where(TrainingsDownloadOptions.user_id == user.id)
+             .values(options=options))
+    db.execute(query)
     db.commit()
-    db.refresh(options)
+    download_options_cache.put(user.id, options)
 
-    return options
+    return convert_download_options_to_dict(user.id, options)
 
 
 def start_date_to_datetime(start_date):
@@ -569,6 +594,17 @@ async def get_trainings(page: int = 1, user_id: int = None, start_date: str = No
     return {"records": result, "total": filtered_data_count, "per_page": per_page, "current_page": page}
 
 
+@router.get('/analysis/cache')
+def get_analysis_cache_stats(request: Request, db: Session = Depends(get_db)):
+    try:
+        token = get_token_by_header(request)
+        user = get_user_by_token(token, db)
+        check_admin_authorized_by_user(user)
+    except GetExceptionWithStatuscode as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    return analysis_cache.stats
+
+
 @router.get("/{training_id}")
 async def get_training(training_id: int, db: Session = Depends(get_db)):
     training_result = (db.query(Training).options(joinedload(Training.user))
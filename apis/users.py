@@ -1,14 +1,15 @@
 import logging
 import os
 from io import BytesIO
-from datetime import datetime, timedelta
+from datetime import datetime
 
 import regex
 from fastapi import APIRouter, Depends, status, HTTPException, Request, UploadFile
 
-from apis.util import get_token_by_header, STUDENT, get_user_by_token, check_authorized_by_user
+from apis.util import get_token_by_header, STUDENT, get_user_by_token, check_authorized_by_user, \
+    get_latest_certifications
 from exceptions import GetException, ExceptionType, GetExceptionWithStatuscode
-from models.model import User, Training, Certification, TrainingProgram, Organization
+from models.model import User, Organization
 
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import select, or_, func, insert, and_
@@ -17,17 +18,15 @@ from sqlalchemy.exc import IntegrityError
 from bcrypt import hashpw
 
 from database import get_db
+from storage import file_storage
 from pandas import read_excel, DataFrame
 
-from boto3 import client
-
 from schema.users import GetListResponseSchema, CreateResponseSchema, CreateRequestSchema, UpdateRequestSchema, \
     GetResponseSchema
 
 router = APIRouter(prefix="/users")
 per_page = 10
 salt = b'$2b$12$apcpayF3r/A/kKo2dlRk8O'
-BUCKET_NAME = 'brayden-online-v2-api-storage'
 
 
 def hashed_data(password: str):
@@ -92,29 +91,12 @@ def validate_file_extension(name: str):
                                          ExceptionType.INCORRECT_FORMAT)
 
 
-def authorize_aws_s3():
-    if os.environ.get('aws_access_key_id') and os.environ.get('aws_secret_access_key'):
-        access_key = os.environ.get('aws_access_key_id')
-        secret_access_key = os.environ.get('aws_secret_access_key')
-        s3 = client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_access_key)
-    else:
-        s3 = client('s3')
-    return s3
-
-
 def upload_excel_to_s3(file):
-    s3 = authorize_aws_s3()
-    buckets = [i['Name'] for i in s3.list_buckets()['Buckets']]
-    if BUCKET_NAME in buckets:
-        ret = s3.upload_fileobj(file, BUCKET_NAME, file.name)
-        location = s3.get_bucket_location(Bucket=BUCKET_NAME)['LocationConstraint']
-        return location
-    return None
+    return file_storage.put(file.name, file)
 
 
 def get_presigned_url_from_upload_file(filename):
-    s3 = authorize_aws_s3()
-    return s3.generate_presigned_url('get_object', Params={'Bucket': BUCKET_NAME, 'Key': filename}, ExpiresIn=3600)
+    return file_storage.url(filename)
 
 
 def insert_each_user(users, organization_id, db: Session = Depends(get_db)):
@@ -301,29 +283,18 @@ async def get_user(request: Request, user_id: int, db: Session = Depends(get_db)
         me = get_my_information_by_token(token, db)
         check_permission(me, user_id, db)
 
-        result_list = (
-            db.query(User, Training, Certification, TrainingProgram).outerjoin(Training, User.id == Training.user_id)
-            .outerjoin(Certification, User.id == Certification.user_id)
-            .outerjoin(TrainingProgram, TrainingProgram.id == Training.training_program_id)
-            .filter(User.id == user_id).order_by(Training.date.desc()))
-        if not result_list:
-            return None
-        # recent training history
-        user, training, certification, training_program = result_list[0]
+        user, last_training_date, certifications = get_latest_certifications(user_id, db)
         # check certification expired date
         certificate = {'adult': {'expiration': None}, 'child': {'expiration': None}, 'baby': {'expiration': None}}
-        for i, result in enumerate(result_list):
-            u, t, c, tp = result
-            # check manikin type
-            if tp and certificate[tp.manikin_type]['expiration'] is None:
-                certificate[tp.manikin_type] = {"expiration": c.issued_date + timedelta(days=365)}
+        for manikin_type, certification in certifications.items():
+            certificate[manikin_type] = {"expiration": certification.expires_at}
         # TODO compare expiration date to current date
 
         return {
             "name": user.name,
             "email": user.email,
             "employee_id": user.employee_id,
-            "last_training_date": training.date if training else None,
+            "last_training_date": last_training_date,
             "certifications": certificate
         }
     except GetExceptionWithStatuscode as e:
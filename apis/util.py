@@ -1,9 +1,12 @@
+import os
+
 from fastapi import status, Request, Depends
 from exceptions import GetExceptionWithStatuscode, ExceptionType
 from models import User
+from models.model import Training, TrainingProgram, Certification
 
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, func, and_
 
 from database import get_db
 
@@ -60,3 +63,40 @@ def check_admin_authorized_by_user(user: User):
                                          exception_type=ExceptionType.INVALID_PERMISSION,
                                          message='no authorization')
     return user
+
+
+def get_latest_certifications(user_id: int, db: Session = Depends(get_db), manikin_type: str = None):
+    # one row per manikin type with the user's latest certificate, ranked in the database so the cost
+    # follows the number of manikin types instead of trainings x certifications
+    ranked = (select(Certification.id, Certification.user_id, TrainingProgram.manikin_type,
+                     func.row_number().over(partition_by=TrainingProgram.manikin_type,
+                                            order_by=(Certification.expires_at.desc(),
+                                                      Certification.id.desc())).label('recency'))
+              .join(Training, Training.id == Certification.training_id)
+              .join(TrainingProgram, TrainingProgram.id == Training.training_program_id)
+              .where(Certification.user_id == user_id))
+    if manikin_type:
+        ranked = ranked.where(TrainingProgram.manikin_type == manikin_type)
+    ranked = ranked.subquery()
+    last_training_date = select(func.max(Training.date)).where(Training.user_id == User.id).scalar_subquery()
+
+    query = (select(User, last_training_date, ranked.c.manikin_type, Certification)
+             .outerjoin(ranked, and_(ranked.c.user_id == User.id, ranked.c.recency == 1))
+             .outerjoin(Certification, Certification.id == ranked.c.id)
+             .where(User.id == user_id))
+    rows = db.execute(query).all()
+    if not rows:
+        raise GetExceptionWithStatuscode(status_code=status.HTTP_404_NOT_FOUND,
+                                         exception_type=ExceptionType.NOT_FOUND,
+                                         message='there is no user')
+    user, last_training_date, _, _ = rows[0]
+    certifications = {manikin: certification for _, _, manikin, certification in rows if certification}
+    return user, last_training_date, certifications
+
+
+def get_file_size(file):
+    position = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
@@ -0,0 +1,7 @@
+from .pool import RendererPool, RendererPoolBusy, renderer_pool, render_pdf, CERTIFICATE_RENDERER_WARM, \
+    CERTIFICATE_RENDERER_POOL_SIZE
+from .renderer import ChromeRenderer
+from .template import render_certificate_html, certificate_templates
+from .logos import normalize_logo, logo_cache, InvalidLogo
+from .cache import certificate_pdf_key, certificate_etag, get_certificate_pdf
+from .archive import iterate_zip
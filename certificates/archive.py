@@ -0,0 +1,59 @@
+import logging
+import zipfile
+from concurrent.futures import Executor, wait, FIRST_COMPLETED
+from typing import Iterable
+
+
+# write only file object, ZipFile cannot seek it and writes each entry with a data descriptor
+class ZipStream:
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iterate_zip(entries: Iterable, executor: Executor, max_pending: int):
+    # entries are (file name, function returning the file's bytes), run on executor with at most max_pending
+    # files rendered or held in memory at a time, each is written to the archive as soon as it is done
+    stream = ZipStream()
+    failed = []
+    pending = dict()
+    # pdfs are already compressed
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        def write_done(futures):
+            for future in futures:
+                name = pending.pop(future)
+                try:
+                    archive.writestr(name, future.result())
+                except Exception as e:
+                    logging.error(f'could not add {name}: {e}')
+                    failed.append(name)
+
+        for name, render in entries:
+            pending[executor.submit(render)] = name
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                write_done(done)
+                yield stream.take()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            write_done(done)
+            yield stream.take()
+        if failed:
+            archive.writestr('failed.txt', '\n'.join(failed))
+    yield stream.take()
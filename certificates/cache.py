@@ -0,0 +1,42 @@
+import hashlib
+import logging
+from io import BytesIO
+
+from storage import file_storage
+from .pool import render_pdf
+from .template import certificate_templates, render_certificate_html
+
+
+def certificate_pdf_key(certification_id: int, template, user_name: str):
+    # a certificate pdf only changes with the user's name, the organization's template or the format file
+    name_hash = hashlib.sha256((user_name or '').encode('utf-8')).hexdigest()[:16]
+    format_version = certificate_templates.load_format()[0]
+    return f'certificates/{certification_id}/{template.id}-{template.version}-{format_version}-{name_hash}.pdf'
+
+
+def certificate_etag(key: str):
+    return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def load_certificate_pdf(key: str):
+    try:
+        with file_storage.open(key) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def store_certificate_pdf(key: str, pdf: bytes):
+    try:
+        file_storage.put(key, BytesIO(pdf))
+    except Exception as e:
+        # the pdf is rendered again on the next download
+        logging.error(e)
+
+
+def get_certificate_pdf(key: str, template, user_name: str, formatted_date: str):
+    pdf = load_certificate_pdf(key)
+    if pdf is None:
+        pdf = render_pdf(render_certificate_html(template, user_name, formatted_date))
+        store_certificate_pdf(key, pdf)
+    return pdf
@@ -0,0 +1,62 @@
+import base64
+import logging
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from lru import LRUCache
+from storage import file_storage
+
+# logos are printed at most about 200x100 css px, twice that keeps them sharp in the pdf
+CERTIFICATE_LOGO_MAX_WIDTH = int(os.getenv('CERTIFICATE_LOGO_MAX_WIDTH', 400))
+CERTIFICATE_LOGO_MAX_HEIGHT = int(os.getenv('CERTIFICATE_LOGO_MAX_HEIGHT', 200))
+CERTIFICATE_LOGO_CACHE_MAX_BYTES = int(os.getenv('CERTIFICATE_LOGO_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+# rendered as an empty image in place of a logo that is missing or unreadable
+EMPTY_DATA_URI = 'data:,'
+
+
+class InvalidLogo(Exception):
+    pass
+
+
+def normalize_logo(file):
+    # any format Pillow reads becomes an optimized png no larger than the printed size
+    try:
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError) as e:
+        raise InvalidLogo(str(e))
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P', 'PA') else 'RGB')
+    image.thumbnail((CERTIFICATE_LOGO_MAX_WIDTH, CERTIFICATE_LOGO_MAX_HEIGHT), Image.LANCZOS)
+    result = BytesIO()
+    image.save(result, format='PNG', optimize=True)
+    result.seek(0)
+    return result
+
+
+# logos as data uris by storage key, uploads get a new key so entries never go stale
+class LogoCache:
+    def __init__(self, max_bytes: int):
+        self._data_uris = LRUCache(max_size=max_bytes, sizeof=len)
+
+    def get(self, key: str):
+        data_uri = self._data_uris.get(key)
+        if data_uri is not None:
+            return data_uri
+
+        # logos stored before uploads were normalized are normalized here
+        try:
+            with file_storage.open(key) as f:
+                png = normalize_logo(BytesIO(f.read()))
+        except (FileNotFoundError, InvalidLogo) as e:
+            # the certificate is still rendered, without this logo; not cached so a re-upload shows up
+            logging.error(f'could not inline certificate logo {key}: {e!r}')
+            return EMPTY_DATA_URI
+        data_uri = f'data:image/png;base64,{base64.b64encode(png.getvalue()).decode("ascii")}'
+        self._data_uris.put(key, data_uri)
+        return data_uri
+
+
+logo_cache = LogoCache(CERTIFICATE_LOGO_CACHE_MAX_BYTES)
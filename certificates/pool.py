@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .renderer import ChromeRenderer
+
+CERTIFICATE_RENDERER_POOL_SIZE = int(os.getenv('CERTIFICATE_RENDERER_POOL_SIZE', 2))
+# renderers started at startup, the rest are started on demand
+CERTIFICATE_RENDERER_WARM = int(os.getenv('CERTIFICATE_RENDERER_WARM', 1))
+# a Chrome session is replaced after this many renders to bound its memory growth
+CERTIFICATE_RENDERER_MAX_RENDERS = int(os.getenv('CERTIFICATE_RENDERER_MAX_RENDERS', 200))
+CERTIFICATE_RENDERER_MAX_WAITING = int(os.getenv('CERTIFICATE_RENDERER_MAX_WAITING', 16))
+CERTIFICATE_RENDERER_ACQUIRE_TIMEOUT = float(os.getenv('CERTIFICATE_RENDERER_ACQUIRE_TIMEOUT', 30))
+CERTIFICATE_RENDERER_INSTALL_DRIVER = os.getenv('CERTIFICATE_RENDERER_INSTALL_DRIVER', 'true').lower() == 'true'
+
+
+class RendererPoolBusy(Exception):
+    pass
+
+
+# lends up to size warm renderers one request at a time, at most max_waiting requests wait for one
+class RendererPool:
+    def __init__(self, factory, size: int, max_renders: int, max_waiting: int, acquire_timeout: float):
+        self.factory = factory
+        self.size = size
+        self.max_renders = max_renders
+        self.max_waiting = max_waiting
+        self.acquire_timeout = acquire_timeout
+        self._idle = []
+        self._created = 0
+        self._waiting = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _take(self):
+        # returns an idle renderer, or None when the caller may create a new one
+        with self._condition:
+            if not self._idle and self._created >= self.size:
+                if self._waiting >= self.max_waiting:
+                    raise RendererPoolBusy('too many certificates are being rendered')
+                self._waiting += 1
+                try:
+                    deadline = time.monotonic() + self.acquire_timeout
+                    while not self._idle and self._created >= self.size:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            raise RendererPoolBusy('timed out waiting for a renderer')
+                        self._condition.wait(timeout)
+                finally:
+                    self._waiting -= 1
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+            return None
+
+    def _create(self):
+        try:
+            return self.factory()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+    def acquire(self):
+        while True:
+            renderer = self._take()
+            if renderer is None:
+                return self._create()
+            if renderer.healthy():
+                return renderer
+            logging.error('discarding unhealthy certificate renderer')
+            self._discard(renderer)
+
+    def release(self, renderer, failed: bool = False):
+        renderer.renders += 1
+        if failed or self._closed or renderer.renders >= self.max_renders:
+            self._discard(renderer)
+            return
+        with self._condition:
+            self._idle.append(renderer)
+            self._condition.notify()
+
+    def _discard(self, renderer):
+        try:
+            renderer.close()
+        except Exception as e:
+            logging.error(e)
+        with self._condition:
+            self._created -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def renderer(self):
+        renderer = self.acquire()
+        try:
+            yield renderer
+        except Exception:
+            self.release(renderer, failed=True)
+            raise
+        self.release(renderer)
+
+    def warm(self, count: int):
+        # starts up to count renderers ahead of the first request
+        for _ in range(count):
+            with self._condition:
+                if self._closed or self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                renderer = self._create()
+            except Exception as e:
+                logging.error(f'could not start certificate renderer: {e}')
+                return
+            with self._condition:
+                self._idle.append(renderer)
+                self._condition.notify()
+
+    def start(self, count: int):
+        threading.Thread(target=self.warm, args=(count,), name='certificate-renderer-warmup', daemon=True).start()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for renderer in idle:
+            self._discard(renderer)
+
+
+def create_renderer():
+    return ChromeRenderer(install_driver=CERTIFICATE_RENDERER_INSTALL_DRIVER)
+
+
+renderer_pool = RendererPool(create_renderer, CERTIFICATE_RENDERER_POOL_SIZE, CERTIFICATE_RENDERER_MAX_RENDERS,
+                             CERTIFICATE_RENDERER_MAX_WAITING, CERTIFICATE_RENDERER_ACQUIRE_TIMEOUT)
+
+
+def render_pdf(html: str):
+    with renderer_pool.renderer() as renderer:
+        return renderer.render_html(html)
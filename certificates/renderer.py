@@ -0,0 +1,61 @@
+import base64
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+
+PRINT_OPTIONS = {
+    'landscape': True,
+    'displayHeaderFooter': False,
+    'printBackground': True,
+    'preferCSSPageSize': True
+}
+
+# resolves once every image of the document has loaded (or failed) and the fonts are ready
+WAIT_FOR_RESOURCES = '''
+const done = arguments[arguments.length - 1];
+const images = Array.from(document.images, image => image.complete ? null : new Promise(resolve => {
+    image.addEventListener('load', resolve);
+    image.addEventListener('error', resolve);
+}));
+Promise.all([document.fonts.ready, ...images]).then(() => done());
+'''
+
+
+# one headless Chrome session that prints pages to PDF through the DevTools protocol
+class ChromeRenderer:
+    def __init__(self, install_driver: bool = True, page_load_timeout: float = 10):
+        options = Options()
+        options.add_argument('--headless')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        if install_driver:
+            from webdriver_manager.chrome import ChromeDriverManager
+            self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+        else:
+            self.driver = webdriver.Chrome(options=options)
+        self.driver.set_page_load_timeout(page_load_timeout)
+        self.driver.set_script_timeout(page_load_timeout)
+        self.driver.get('about:blank')
+        self.renders = 0
+
+    def healthy(self):
+        try:
+            self.driver.execute_cdp_cmd('Browser.getVersion', {})
+            return True
+        except Exception:
+            return False
+
+    def render_html(self, html: str, print_options: dict = None):
+        # the document is handed to the blank page directly, nothing is written to disk
+        frame_id = self.driver.execute_cdp_cmd('Page.getFrameTree', {})['frameTree']['frame']['id']
+        self.driver.execute_cdp_cmd('Page.setDocumentContent', {'frameId': frame_id, 'html': html})
+        self.driver.execute_async_script(WAIT_FOR_RESOURCES)
+        result = self.driver.execute_cdp_cmd('Page.printToPDF', {**PRINT_OPTIONS, **(print_options or {})})
+        # leave nothing of this certificate behind for the next render
+        self.driver.get('about:blank')
+        return base64.b64decode(result['data'])
+
+    def close(self):
+        self.driver.quit()
@@ -0,0 +1,131 @@
+import hashlib
+import html
+import json
+import logging
+import os
+import re
+import threading
+
+from .logos import logo_cache
+
+CERTIFICATE_FORMAT_PATH = os.getenv('CERTIFICATE_FORMAT_PATH', 'certificate_download_format.html')
+
+# slots of certificate_download_format.html are explicit {{name}} markers, text elsewhere in the format (css
+# selectors, attributes, copy) is never touched. Logos are whole <img class="logo" src="{{top_left}}" ...> tags that
+# are dropped when the organization has no image for them
+SLOT_PATTERN = re.compile(r'<img\b[^>]*?\bsrc=(?P<image>(?P<quote>["\']?)\{\{\s*(?P<image_name>top_left|top_right|'
+                          r'bottom_left|bottom_right)\s*\}\}(?P=quote))[^>]*>'
+                          r'|\{\{\s*(?P<text>user_name|certification_title|manikin_type|organization_name|'
+                          r'formatted_date)\s*\}\}')
+# slots filled from the organization's CertificationsTemplate when the template is compiled
+TEMPLATE_SLOTS = {
+    'certification_title': lambda template: template.title or '',
+    'manikin_type': lambda template: template.manikin_type,
+    'organization_name': lambda template: template.organization_name
+}
+
+
+class Slot:
+    __slots__ = ('name', 'before', 'after')
+
+    def __init__(self, name: str, before: str = '', after: str = ''):
+        self.name = name
+        # tag text around an image url
+        self.before = before
+        self.after = after
+
+
+def parse_certificate_format(source: str):
+    tokens = []
+    position = 0
+    for match in SLOT_PATTERN.finditer(source):
+        tokens.append(source[position:match.start()])
+        if match.group('image_name'):
+            tag = match.group(0)
+            start, end = match.start('image') - match.start(), match.end('image') - match.start()
+            tokens.append(Slot(match.group('image_name'), tag[:start], tag[end:]))
+        else:
+            tokens.append(Slot(match.group('text')))
+        position = match.end()
+    tokens.append(source[position:])
+    if len(tokens) == 1:
+        logging.warning('certificate format has no {{...}} slots, certificates are rendered without user data')
+    return tokens
+
+
+def hash_template_fields(template):
+    fields = [template.title, template.manikin_type, template.organization_name, template.images]
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def compile_certificate(tokens: list, template):
+    # organization values are written into the literal text, only the per user slots and the logos (kept in
+    # memory by logo_cache) are left for render time
+    segments = []
+    for token in tokens:
+        if isinstance(token, Slot) and token.name in TEMPLATE_SLOTS:
+            token = html.escape(TEMPLATE_SLOTS[token.name](template))
+        elif isinstance(token, Slot) and token.before:
+            if not template.images.get(token.name):
+                continue
+            token = Slot(template.images[token.name], token.before, token.after)
+
+        if isinstance(token, str) and segments and isinstance(segments[-1], str):
+            segments[-1] += token
+        elif token != '':
+            segments.append(token)
+    return segments
+
+
+# certificate format compiled per CertificationsTemplate, recompiled when the format or the template changes
+class CertificateTemplateCache:
+    def __init__(self, path: str):
+        self.path = path
+        self._format = (None, None, None)
+        self._compiled = dict()
+        self._lock = threading.Lock()
+
+    def load_format(self):
+        # returns (hash of the format file's content, tokens), the file is read again only when its mtime changes.
+        # the hash versions rendered certificates, it is the same on every host and across deploys
+        mtime = os.stat(self.path).st_mtime_ns
+        with self._lock:
+            if self._format[0] == mtime:
+                return self._format[1:]
+        with open(self.path, 'r') as f:
+            source = f.read()
+        digest = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+        tokens = parse_certificate_format(source)
+        with self._lock:
+            self._format = (mtime, digest, tokens)
+        return digest, tokens
+
+    def get(self, template):
+        format_version, tokens = self.load_format()
+        version = (format_version, hash_template_fields(template))
+        with self._lock:
+            compiled = self._compiled.get(template.id)
+        if compiled is not None and compiled[0] == version:
+            return compiled[1]
+
+        segments = compile_certificate(tokens, template)
+        with self._lock:
+            self._compiled[template.id] = (version, segments)
+        return segments
+
+
+certificate_templates = CertificateTemplateCache(CERTIFICATE_FORMAT_PATH)
+
+
+def render_certificate_html(template, user_name: str, formatted_date: str):
+    values = {'user_name': html.escape(user_name or ''), 'formatted_date': html.escape(formatted_date)}
+    parts = []
+    for segment in certificate_templates.get(template):
+        if isinstance(segment, str):
+            parts.append(segment)
+        elif segment.before:
+            # inlined, the renderer makes no network request for logos
+            parts.append(f'{segment.before}"{logo_cache.get(segment.name)}"{segment.after}')
+        else:
+            parts.append(values[segment.name])
+    return ''.join(parts)
@@ -1,5 +1,9 @@
+import logging
+import os
+
 from fastapi import FastAPI, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.formparsers import MultiPartParser
 
 from sqlalchemy.orm import Session
 from database import get_db, Base, engine
@@ -7,9 +11,26 @@ from database import get_db, Base, engine
 from models.model import CPRGuideline
 
 from apis import api
+from apis.request_limit import RequestSizeLimitMiddleware, TRAINING_REQUEST_MAX_BYTES
+from apis.storage_outbox import storage_delete_sweeper
+from certificates import renderer_pool, CERTIFICATE_RENDERER_WARM
+from storage import file_storage
 
 Base.metadata.create_all(bind=engine)
 
+# module loggers of the api (apis.*) report metrics at info, the root logger is left at its default
+APP_LOG_LEVEL = os.getenv('APP_LOG_LEVEL', 'INFO')
+app_logger = logging.getLogger('apis')
+app_logger.setLevel(APP_LOG_LEVEL)
+if not app_logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    app_logger.addHandler(log_handler)
+    app_logger.propagate = False
+
+# uploaded files larger than this are spooled to disk instead of memory
+MultiPartParser.max_file_size = int(os.getenv('UPLOAD_SPOOL_MAX_SIZE', 1024 * 1024))
+
 app = FastAPI()
 
 app.add_middleware(
@@ -19,10 +40,27 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# oversized recordings are refused while they are received, not after they were spooled
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=TRAINING_REQUEST_MAX_BYTES, paths={'/trainings'})
 app.include_router(api.api_router)
 app.router.redirect_slashes = False
 
 
+@app.on_event("startup")
+def start_services():
+    # looked up once here instead of on every upload
+    file_storage.check()
+    # picks up deletes left over from the last run
+    storage_delete_sweeper.start()
+    # Chrome takes seconds to start, have renderers ready before the first certificate download
+    renderer_pool.start(CERTIFICATE_RENDERER_WARM)
+
+
+@app.on_event("shutdown")
+def close_renderers():
+    renderer_pool.close()
+
+
 @app.get("/")
 async def root():
     return "Hi"
@@ -1,6 +1,9 @@
+from enum import IntFlag
+
 from database import Base
+from storage import file_storage
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DATETIME, BOOLEAN, func
+from sqlalchemy import Column, Integer, String, ForeignKey, DATETIME, func
 from sqlalchemy.types import JSON
 from sqlalchemy.orm import relationship
 
@@ -103,26 +106,7 @@ class TrainingProgramContent(Base):
 
     @property
     def presigned_url(self):
-        # TODO: DELETE THIS
-        def authorize_aws_s3():
-            import os
-            from boto3 import client
-            if os.environ.get('aws_access_key_id') and os.environ.get('aws_secret_access_key'):
-                access_key = os.environ.get('aws_access_key_id')
-                secret_access_key = os.environ.get('aws_secret_access_key')
-                s3 = client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_access_key)
-            else:
-                s3 = client('s3')
-            return s3
-
-        # TODO: DELETE THIS
-        BUCKET_NAME = 'brayden-online-v2-api-storage'
-
-        s3 = authorize_aws_s3()
-        return s3.generate_presigned_url('get_object',
-                                         Params={'Bucket': BUCKET_NAME,
-                                                 'Key': self.s3_key},
-                                         ExpiresIn=3600)
+        return file_storage.url(self.s3_key)
 
     @property
     def convert_to_schema(self):
@@ -147,26 +131,7 @@ class OrganizationContent(Base):
 
     @property
     def presigned_url(self):
-        # TODO: DELETE THIS
-        def authorize_aws_s3():
-            import os
-            from boto3 import client
-            if os.environ.get('aws_access_key_id') and os.environ.get('aws_secret_access_key'):
-                access_key = os.environ.get('aws_access_key_id')
-                secret_access_key = os.environ.get('aws_secret_access_key')
-                s3 = client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_access_key)
-            else:
-                s3 = client('s3')
-            return s3
-
-        # TODO: DELETE THIS
-        BUCKET_NAME = 'brayden-online-v2-api-storage'
-
-        s3 = authorize_aws_s3()
-        return s3.generate_presigned_url('get_object',
-                                         Params={'Bucket': BUCKET_NAME,
-                                                 'Key': self.s3_key},
-                                         ExpiresIn=3600)
+        return file_storage.url(self.s3_key)
 
     @property
     def convert_to_schema(self):
@@ -186,36 +151,19 @@ class CertificationsTemplate(Base):
     manikin_type = Column(String(50))
     organization_name = Column(String(50))
     images = Column(JSON)
+    # bumped on every update, part of the cache key of rendered certificates
+    version = Column(Integer, default=1, server_default='1', nullable=False)
     organization_id = Column(Integer, ForeignKey('organization.id'))
 
     organization = relationship('Organization', back_populates='certifications_template')
 
     @property
     def presigned_url(self):
-        # TODO: DELETE THIS
-        def authorize_aws_s3():
-            import os
-            from boto3 import client
-            if os.environ.get('aws_access_key_id') and os.environ.get('aws_secret_access_key'):
-                access_key = os.environ.get('aws_access_key_id')
-                secret_access_key = os.environ.get('aws_secret_access_key')
-                s3 = client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_access_key)
-            else:
-                s3 = client('s3')
-            return s3
-
-        # TODO: DELETE THIS
-        BUCKET_NAME = 'brayden-online-v2-api-storage'
-
-        s3 = authorize_aws_s3()
         images_url = dict()
         for k in self.images.keys():
             images_url[k] = None
             if self.images[k]:
-                images_url[k] = s3.generate_presigned_url('get_object',
-                                                          Params={'Bucket': BUCKET_NAME,
-                                                                  'Key': self.images[k]},
-                                                          ExpiresIn=3600)
+                images_url[k] = file_storage.url(self.images[k])
         return images_url
 
     @property
@@ -249,6 +197,7 @@ class Certification(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     issued_date = Column(DATETIME, server_default=func.now())
+    expires_at = Column(DATETIME, index=True)
     user_id = Column(Integer, ForeignKey('user.id'))
     training_id = Column(Integer, ForeignKey('training.id'))
 
@@ -256,36 +205,95 @@ class Certification(Base):
     training = relationship('Training', back_populates='certification')
 
 
+class TrainingIdempotencyKey(Base):
+    __tablename__ = 'training_idempotency_key'
+
+    key = Column(String(100), primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    training_id = Column(Integer, ForeignKey('training.id'))
+    response = Column(JSON)
+    created_at = Column(DATETIME, server_default=func.now())
+
+
+class TrainingsExportJob(Base):
+    __tablename__ = 'trainings_export_job'
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), index=True)
+    status = Column(String(20))
+    file_format = Column(String(10))
+    artifact_key = Column(String(300))
+    created_at = Column(DATETIME, server_default=func.now())
+    finished_at = Column(DATETIME)
+    user_id = Column(Integer, ForeignKey('user.id'))
+    organization_id = Column(Integer, ForeignKey('organization.id'))
+
+
+class StorageDeleteOutbox(Base):
+    # objects to delete from the storage, written in the same transaction as the row that referenced them
+    __tablename__ = 'storage_delete_outbox'
+
+    id = Column(Integer, primary_key=True, index=True)
+    object_key = Column(String(300))
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DATETIME)
+    last_error = Column(String(300))
+    created_at = Column(DATETIME, server_default=func.now())
+
+
+class DownloadOption(IntFlag):
+    # bit positions are stored in trainings_download_options.options, only append new flags
+    EMAIL = 1 << 0
+    SCORE = 1 << 1
+    USERNAME = 1 << 2
+    DATETIME = 1 << 3
+    AVERAGE_COMPRESSION_DEPTH = 1 << 4
+    AVERAGE_HANDS_OFF_TIME = 1 << 5
+    COMPRESSION_NUMBER = 1 << 6
+    EVENT_TIME = 1 << 7
+    MANIKIN_MODEL = 1 << 8
+    OVERALL_CCF = 1 << 9
+    OVERALL_COMPRESSION_NO = 1 << 10
+    OVERALL_HAND_POSITION = 1 << 11
+    OVERALL_VENTILATION_RATE = 1 << 12
+    OVERALL_VENTILATION_VOLUME = 1 << 13
+    AVERAGE_COMPRESSION_RATE = 1 << 14
+    AVERAGE_VOLUME = 1 << 15
+    CYCLE_NUMBER = 1 << 16
+    JUDGE_RESULT = 1 << 17
+    OVERALL_COMPRESSION_DEPTH = 1 << 18
+    OVERALL_COMPRESSION_RATE = 1 << 19
+    OVERALL_RECOIL = 1 << 20
+    OVERALL_VENTILATION_SPEED = 1 << 21
+    PERCENTAGE_CCF = 1 << 22
+    TARGET = 1 << 23
+    TYPE = 1 << 24
+    DEVICE_ID = 1 << 25
+    NAME = 1 << 26
+
+    @classmethod
+    def from_dict(cls, options: dict, base: int = 0):
+        # options are exchanged with clients as {"email": true, ...}, missing keys keep the base value
+        mask = base
+        for option in cls:
+            key = option.name.lower()
+            if key in options:
+                mask = mask | option if options[key] else mask & ~option
+        return int(mask)
+
+    @classmethod
+    def to_dict(cls, mask: int):
+        return {option.name.lower(): bool(mask & option) for option in cls}
+
+
+DEFAULT_DOWNLOAD_OPTIONS = int(DownloadOption.EMAIL | DownloadOption.SCORE | DownloadOption.USERNAME |
+                               DownloadOption.DATETIME)
+
+
 class TrainingsDownloadOptions(Base):
     __tablename__ = "trainings_download_options"
 
     user_id = Column(Integer, ForeignKey('user.id'), primary_key=True, index=True)
-    email = Column(BOOLEAN, default=True)
-    score = Column(BOOLEAN, default=True)
-    username = Column(BOOLEAN, default=True)
-    datetime = Column(BOOLEAN, default=True)
-    average_compression_depth = Column(BOOLEAN, default=False)
-    average_hands_off_time = Column(BOOLEAN, default=False)
-    compression_number = Column(BOOLEAN, default=False)
-    event_time = Column(BOOLEAN, default=False)
-    manikin_model = Column(BOOLEAN, default=False)
-    overall_ccf = Column(BOOLEAN, default=False)
-    overall_compression_no = Column(BOOLEAN, default=False)
-    overall_hand_position = Column(BOOLEAN, default=False)
-    overall_ventilation_rate = Column(BOOLEAN, default=False)
-    overall_ventilation_volume = Column(BOOLEAN, default=False)
-    average_compression_rate = Column(BOOLEAN, default=False)
-    average_volume = Column(BOOLEAN, default=False)
-    cycle_number = Column(BOOLEAN, default=False)
-    judge_result = Column(BOOLEAN, default=False)
-    overall_compression_depth = Column(BOOLEAN, default=False)
-    overall_compression_rate = Column(BOOLEAN, default=False)
-    overall_recoil = Column(BOOLEAN, default=False)
-    overall_ventilation_speed = Column(BOOLEAN, default=False)
-    percentage_ccf = Column(BOOLEAN, default=False)
-    target = Column(BOOLEAN, default=False)
-    type = Column(BOOLEAN, default=False)
-    device_id = Column(BOOLEAN, default=False)
-    name = Column(BOOLEAN, default=False)
+    options = Column(Integer, default=DEFAULT_DOWNLOAD_OPTIONS, nullable=False)
 
     user = relationship('User', back_populates='trainings_download_options')
@@ -0,0 +1,29 @@
+from datetime import datetime
+from typing import Optional, List
+
+from pydantic import BaseModel
+
+
+class BulkDownloadRequestSchema(BaseModel):
+    manikin_type: str = 'adult'
+    # certificates of these users, or of every user of the organization when empty
+    user_ids: Optional[List[int]] = None
+    # issued between these dates (YYYY-MM-DD)
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+
+
+class ExpiringCertificateSchema(BaseModel):
+    certification_id: int
+    user_id: int
+    name: str | None
+    email: str | None
+    employee_id: str | None
+    issued_date: datetime | None
+    expires_at: datetime
+    expired: bool
+
+
+class ExpiringCertificateListSchema(BaseModel):
+    manikin_type: str
+    certifications: List[ExpiringCertificateSchema]
@@ -136,3 +136,11 @@ class TrainingListSchema:
         self.training_program = TrainingProgramLimitSchema(training_result.training_program)
         self.user = UserSchema(training_result.user)
         self.score = training_result.score
+
+
+class ExportJobResponseSchema(BaseModel):
+    id: int
+    status: str
+    file_format: str
+    created_at: datetime | None = None
+    finished_at: datetime | None = None
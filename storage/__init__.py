@@ -0,0 +1,29 @@
+import os
+
+from .base import Storage, SignedUrlCache
+from .local import LocalStorage
+from .s3 import S3Storage, BUCKET_NAME, get_s3_client
+
+# s3 or local
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 's3')
+STORAGE_LOCAL_ROOT = os.getenv('STORAGE_LOCAL_ROOT', 'storage_data')
+# base url of this api, local storage urls are served by its /files endpoint
+STORAGE_PUBLIC_URL = os.getenv('STORAGE_PUBLIC_URL', 'http://localhost:8000')
+STORAGE_URL_SECRET = os.getenv('STORAGE_URL_SECRET')
+PRESIGNED_URL_EXPIRES_IN = int(os.getenv('PRESIGNED_URL_EXPIRES_IN', 3600))
+# a cached url is re-signed once less than this many seconds of validity are left
+PRESIGNED_URL_MIN_REMAINING = int(os.getenv('PRESIGNED_URL_MIN_REMAINING', 900))
+PRESIGNED_URL_CACHE_MAX_ENTRIES = int(os.getenv('PRESIGNED_URL_CACHE_MAX_ENTRIES', 10000))
+
+
+def create_storage():
+    url_options = (PRESIGNED_URL_CACHE_MAX_ENTRIES, PRESIGNED_URL_EXPIRES_IN, PRESIGNED_URL_MIN_REMAINING)
+    if STORAGE_BACKEND == 'local':
+        # urls signed by one worker are verified by the others and have to survive restarts
+        if not STORAGE_URL_SECRET:
+            raise RuntimeError('STORAGE_URL_SECRET has to be set when STORAGE_BACKEND is local')
+        return LocalStorage(STORAGE_LOCAL_ROOT, STORAGE_PUBLIC_URL, STORAGE_URL_SECRET, *url_options)
+    return S3Storage(BUCKET_NAME, *url_options)
+
+
+file_storage = create_storage()
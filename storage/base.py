@@ -0,0 +1,72 @@
+from abc import ABC, abstractmethod
+
+from lru import LRUCache
+
+
+# object storage for uploaded content, template images, user import reports and export artifacts,
+# addressed by key, e.g. 'content/video_1700000000000.mp4'
+class Storage(ABC):
+    @abstractmethod
+    def check(self):
+        # called once at startup, returns whether uploads can be accepted
+        pass
+
+    @abstractmethod
+    def put(self, key: str, file):
+        # stores the file object under key, returns False when the storage is not available
+        pass
+
+    @abstractmethod
+    def open(self, key: str):
+        # readable binary file object of the stored object, FileNotFoundError when there is none
+        pass
+
+    @abstractmethod
+    def url(self, key: str):
+        # url a client can GET the object from without further authorization
+        pass
+
+    @abstractmethod
+    def exists(self, key: str):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def delete_many(self, keys: list):
+        # returns {key: error} for the keys that could not be deleted, missing objects count as deleted
+        pass
+
+
+# signed urls by object key, a url is served while it still has min_remaining seconds of validity so clients
+# get the same string across requests and can cache the object behind it
+class SignedUrlCache:
+    def __init__(self, sign, max_entries: int, expires_in: int, min_remaining: int, signature_lifetime=None):
+        # sign(key, expires_in) returns a url valid for expires_in seconds, unless the credentials it was signed
+        # with expire earlier: signature_lifetime() returns their remaining seconds, None when they do not expire
+        self.sign = sign
+        self.signature_lifetime = signature_lifetime
+        self.expires_in = expires_in
+        self.min_remaining = min(min_remaining, expires_in // 2)
+        self._urls = LRUCache(max_entries)
+
+    def get(self, key: str):
+        url = self._urls.get(key)
+        if url is not None:
+            return url
+
+        # signing is local (no request to the storage), a concurrent miss just signs twice
+        url = self.sign(key, self.expires_in)
+        lifetime = self.expires_in
+        if self.signature_lifetime is not None:
+            remaining = self.signature_lifetime()
+            if remaining is not None:
+                lifetime = min(lifetime, remaining)
+        if lifetime > self.min_remaining:
+            self._urls.put(key, url, ttl=lifetime - self.min_remaining)
+        return url
+
+    def invalidate(self, key: str):
+        self._urls.pop(key)
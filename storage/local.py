@@ -0,0 +1,81 @@
+import hashlib
+import hmac
+import os
+import shutil
+import time
+from tempfile import NamedTemporaryFile
+from urllib.parse import quote, urlencode
+
+from .base import Storage, SignedUrlCache
+
+CHUNK_SIZE = 1024 * 1024
+
+
+# objects as files under root, urls point at /files and carry an expiry and an HMAC signature
+class LocalStorage(Storage):
+    def __init__(self, root: str, public_url: str, secret: str, url_cache_max_entries: int, url_expires_in: int,
+                 url_min_remaining: int):
+        self.root = os.path.abspath(root)
+        self.public_url = public_url.rstrip('/')
+        self.secret = secret.encode('utf-8')
+        self.url_cache = SignedUrlCache(self.sign_url, url_cache_max_entries, url_expires_in, url_min_remaining)
+
+    def path(self, key: str):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if os.path.commonpath([self.root, path]) != self.root or path == self.root:
+            raise ValueError(f'invalid storage key {key}')
+        return path
+
+    def check(self):
+        os.makedirs(self.root, exist_ok=True)
+        return True
+
+    def put(self, key: str, file):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write next to the destination and rename, readers never see a partial file
+        with NamedTemporaryFile('wb', dir=os.path.dirname(path), delete=False) as f:
+            try:
+                shutil.copyfileobj(file, f, CHUNK_SIZE)
+            except Exception:
+                os.remove(f.name)
+                raise
+        os.replace(f.name, path)
+        self.url_cache.invalidate(key)
+        return True
+
+    def open(self, key: str):
+        return open(self.path(key), 'rb')
+
+    def signature(self, key: str, expires: int):
+        return hmac.new(self.secret, f'{key}\n{expires}'.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def verify(self, key: str, expires: int, signature: str):
+        return expires >= time.time() and hmac.compare_digest(self.signature(key, expires), signature)
+
+    def sign_url(self, key: str, expires_in: int):
+        expires = int(time.time()) + expires_in
+        query = urlencode({'expires': expires, 'signature': self.signature(key, expires)})
+        return f'{self.public_url}/files/{quote(key)}?{query}'
+
+    def url(self, key: str):
+        return self.url_cache.get(key)
+
+    def exists(self, key: str):
+        return os.path.isfile(self.path(key))
+
+    def delete(self, key: str):
+        self.url_cache.invalidate(key)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_many(self, keys: list):
+        failed = dict()
+        for key in keys:
+            try:
+                self.delete(key)
+            except (OSError, ValueError) as e:
+                failed[key] = str(e)
+        return failed
@@ -0,0 +1,154 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from boto3 import client
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from .base import Storage, SignedUrlCache
+
+BUCKET_NAME = os.getenv('S3_BUCKET_NAME', 'brayden-online-v2-api-storage')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 50))
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', 5))
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', 60))
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', 3))
+# seconds before a failed bucket check is tried again
+S3_CHECK_RETRY_INTERVAL = float(os.getenv('S3_CHECK_RETRY_INTERVAL', 30))
+# uploads larger than the threshold are sent as multipart uploads of chunksize parts, max_concurrency at a time
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
+S3_MULTIPART_MAX_CONCURRENCY = int(os.getenv('S3_MULTIPART_MAX_CONCURRENCY', 8))
+
+_s3 = None
+_s3_lock = threading.Lock()
+
+
+def create_s3_client():
+    options = {
+        'config': Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                         connect_timeout=S3_CONNECT_TIMEOUT,
+                         read_timeout=S3_READ_TIMEOUT,
+                         retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'standard'})
+    }
+    if S3_ENDPOINT_URL:
+        options['endpoint_url'] = S3_ENDPOINT_URL
+    if os.environ.get('aws_access_key_id') and os.environ.get('aws_secret_access_key'):
+        options['aws_access_key_id'] = os.environ.get('aws_access_key_id')
+        options['aws_secret_access_key'] = os.environ.get('aws_secret_access_key')
+    return client('s3', **options)
+
+
+def get_s3_client():
+    # boto3 clients are thread safe, one client (and its connection pool) is shared by the whole process
+    global _s3
+    if _s3 is None:
+        with _s3_lock:
+            if _s3 is None:
+                _s3 = create_s3_client()
+    return _s3
+
+
+def get_credentials_lifetime():
+    # presigned urls stop working with the session token they were signed with. instance or task role
+    # credentials are refreshable and expire, static keys have no expiry
+    credentials = get_s3_client()._request_signer._credentials
+    expiry = getattr(credentials, '_expiry_time', None)
+    if expiry is None:
+        return None
+    return (expiry - datetime.now(timezone.utc)).total_seconds()
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, url_cache_max_entries: int, url_expires_in: int, url_min_remaining: int):
+        self.bucket = bucket
+        self.location = None
+        self._available = False
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self.transfer_config = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD,
+                                              multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+                                              max_concurrency=S3_MULTIPART_MAX_CONCURRENCY)
+        self.url_cache = SignedUrlCache(self.presign, url_cache_max_entries, url_expires_in, url_min_remaining,
+                                        get_credentials_lifetime)
+
+    def check(self):
+        # a successful check (at startup) is kept for the process, a failed one is retried by the next upload
+        # once S3_CHECK_RETRY_INTERVAL has passed
+        if self._available:
+            return True
+        with self._lock:
+            if self._available:
+                return True
+            if self._checked_at is not None and time.monotonic() - self._checked_at < S3_CHECK_RETRY_INTERVAL:
+                return False
+            self._available = self.load_bucket_location()
+            self._checked_at = time.monotonic()
+            return self._available
+
+    def load_bucket_location(self):
+        s3 = get_s3_client()
+        try:
+            s3.head_bucket(Bucket=self.bucket)
+            # us-east-1 buckets report no location constraint
+            self.location = s3.get_bucket_location(Bucket=self.bucket)['LocationConstraint'] or 'us-east-1'
+        except Exception as e:
+            logging.error(f'bucket {self.bucket} is not available: {e}')
+            return False
+        return True
+
+    def put(self, key: str, file):
+        if not self.check():
+            return False
+        get_s3_client().upload_fileobj(file, self.bucket, key, Config=self.transfer_config)
+        self.url_cache.invalidate(key)
+        return True
+
+    def open(self, key: str):
+        try:
+            return get_s3_client().get_object(Bucket=self.bucket, Key=key)['Body']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(key)
+            raise
+
+    def presign(self, key: str, expires_in: int):
+        return get_s3_client().generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': key},
+                                                      ExpiresIn=expires_in)
+
+    def url(self, key: str):
+        return self.url_cache.get(key)
+
+    def exists(self, key: str):
+        try:
+            get_s3_client().head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def delete(self, key: str):
+        self.url_cache.invalidate(key)
+        get_s3_client().delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_many(self, keys: list):
+        failed = dict()
+        # delete_objects takes at most 1000 keys per request
+        for i in range(0, len(keys), 1000):
+            chunk = keys[i:i + 1000]
+            for key in chunk:
+                self.url_cache.invalidate(key)
+            try:
+                ret = get_s3_client().delete_objects(Bucket=self.bucket,
+                                                     Delete={'Objects': [{'Key': key} for key in chunk],
+                                                             'Quiet': True})
+            except Exception as e:
+                failed.update((key, str(e)) for key in chunk)
+                continue
+            failed.update((error['Key'], error.get('Message', error.get('Code'))) for error in ret.get('Errors', []))
+        return failed
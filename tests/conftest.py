@@ -0,0 +1,60 @@
+import os
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+
+_data_dir = tempfile.mkdtemp()
+os.environ['DB_URL'] = f'sqlite:///{os.path.join(_data_dir, "test.db")}'
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ['STORAGE_LOCAL_ROOT'] = os.path.join(_data_dir, 'storage')
+os.environ['STORAGE_URL_SECRET'] = 'test'
+os.environ['TRAINING_GROUP_COMMIT'] = 'false'
+
+import pytest
+from sqlalchemy import event
+
+import main  # noqa: F401, creates the tables
+from database import SessionLocal, engine
+from models.model import Organization, UserRole, User, CPRGuideline, TrainingProgram
+
+TOKEN = 'test-token'
+
+
+@pytest.fixture(scope='session')
+def training_programs():
+    db = SessionLocal()
+    organization = Organization(organization_name='organization')
+    guideline = CPRGuideline(title='AHA', compression_depth={}, ventilation_volume={})
+    db.add_all([organization, guideline, UserRole(id=1, role='student')])
+    db.flush()
+    db.add(User(email='student@example.com', name='student', token=TOKEN, user_role_id=1,
+                organization_id=organization.id))
+    programs = {}
+    for training_mode in ['assessment', 'dry-run']:
+        programs[training_mode] = TrainingProgram(title=training_mode, manikin_type='adult',
+                                                  training_type='CPR Training', feedback_type='on',
+                                                  training_mode=training_mode, organization_id=organization.id,
+                                                  cpr_guideline_id=guideline.id)
+        db.add(programs[training_mode])
+    db.commit()
+    yield {training_mode: program.id for training_mode, program in programs.items()}
+    db.close()
+
+
+@contextmanager
+def count_statements():
+    counts = Counter()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counts[statement.split(None, 1)[0].upper()] += 1
+
+    def commit(conn):
+        counts['COMMIT'] += 1
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'commit', commit)
+    try:
+        yield counts
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        event.remove(engine, 'commit', commit)
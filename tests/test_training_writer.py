@@ -0,0 +1,43 @@
+from sqlalchemy import select
+
+from apis.training_writer import GroupCommitWriter
+from conftest import count_statements
+from database import SessionLocal
+from models.model import User, Training, Certification
+
+
+def test_batch_links_certifications_to_their_trainings(training_programs):
+    db = SessionLocal()
+    users = [User(email=f'writer{i}@example.com', name=f'writer {i}', user_role_id=1) for i in range(8)]
+    db.add_all(users)
+    db.commit()
+    user_ids = [user.id for user in users]
+    db.close()
+
+    # a long delay so every submission lands in the same batch
+    writer = GroupCommitWriter(SessionLocal, max_batch=64, max_delay=0.5)
+    submissions = []
+    for user_id in user_ids:
+        training = Training(score=user_id, result={}, data={}, user_id=user_id,
+                            training_program_id=training_programs['assessment'])
+        certification = Certification(user_id=user_id, training=training)
+        submissions.append((user_id, training, certification))
+
+    with count_statements() as counts:
+        futures = [writer.submit([training, certification]) for _, training, certification in submissions]
+        for future in futures:
+            future.result(timeout=5)
+
+    assert counts['COMMIT'] == 1
+    db = SessionLocal()
+    try:
+        for user_id, training, certification in submissions:
+            stored_training = db.get(Training, training.id)
+            stored_certification = db.get(Certification, certification.id)
+            assert stored_training.user_id == user_id
+            assert stored_certification.user_id == user_id
+            assert stored_certification.training_id == training.id
+        query = select(Certification.training_id).where(Certification.user_id.in_(user_ids))
+        assert sorted(db.scalars(query).all()) == sorted(training.id for _, training, _ in submissions)
+    finally:
+        db.close()
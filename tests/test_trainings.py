@@ -0,0 +1,74 @@
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import apis.analysis
+import apis.trainings
+import main
+from conftest import TOKEN, count_statements
+
+TRAIN_CONDITION = {
+    'Usage': {'Email': '', 'Type': '', 'Timestamp': 0, 'CreateEpoch': 0},
+    'Custom': {'TrainCourse': {'Certification': False, 'Guideline': '', 'Feedback': '', 'Type': '', 'CardTitle': ''}}
+}
+
+ANALYSIS_RESULT = {
+    'Usage': {'Timestamp': 1700000000}, 'Guide_prompts': [],
+    'ResultSummary': {'JudgResult': 'Pass'},
+    'ResultByCycle': {'ScoreByCycle': {'Overall': 90, 'ByCycle': [90]},
+                      'Recoil': {'Overall': 1, 'ByCycle': [1]},
+                      'CompressionDepth': {'Overall': 2, 'ByCycle': [2]},
+                      'CompressionRate': {'Overall': 3, 'ByCycle': [3]},
+                      'VentilationVolume': {'Overall': 4, 'ByCycle': [4]},
+                      'VentilationRate': {'Overall': 5, 'ByCycle': [5]},
+                      'HandPosition': {'Overall': 6, 'ByCycle': [6]},
+                      'ScoreOfCCF': 'N/A'}
+}
+
+
+class AnalysisResponse:
+    ok = True
+    content = json.dumps(ANALYSIS_RESULT).encode('utf-8')
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, training_programs):
+    # the condition template is read from the working directory
+    (tmp_path / 'genk-adult-pass_train_condition.json').write_text(json.dumps(TRAIN_CONDITION))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(apis.analysis.requests, 'post', lambda *args, **kwargs: AnalysisResponse())
+    # background renders would query the database while statements are counted
+    monkeypatch.setattr(apis.trainings, 'enqueue_certificate_render', lambda certification_id: None)
+    return TestClient(main.app)
+
+
+def submit_training(client, training_program_id: int, raw: bytes):
+    return client.post('/trainings', headers={'Authorization': TOKEN},
+                       data={'training_program_id': str(training_program_id), 'training_data': '{}'},
+                       files={'rawHexBPfile': ('raw.bin', io.BytesIO(raw), 'application/octet-stream')})
+
+
+def test_training_without_certificate_is_stored_in_one_commit(client, training_programs):
+    with count_statements() as counts:
+        response = submit_training(client, training_programs['dry-run'], b'\x01')
+
+    assert response.status_code == 201
+    # user by token, training program with its guideline
+    assert counts['SELECT'] == 2
+    assert counts['INSERT'] == 1
+    assert counts['UPDATE'] == 0
+    assert counts['COMMIT'] == 1
+
+
+def test_training_with_certificate_is_stored_in_one_commit(client, training_programs):
+    with count_statements() as counts:
+        response = submit_training(client, training_programs['assessment'], b'\x02')
+
+    assert response.status_code == 201
+    assert counts['SELECT'] == 2
+    # training and certification
+    assert counts['INSERT'] == 2
+    assert counts['UPDATE'] == 0
+    assert counts['COMMIT'] == 1